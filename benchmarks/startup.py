@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Time how long `merge` takes to start.
+
+Usage: python3 benchmarks/startup.py [runs]
+
+Reports the best and median wall clock time of importing the CLI module,
+`merge --version`, and `merge --help`, each in a fresh interpreter.
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    "import mergeinator.merge": [sys.executable, "-c", "import mergeinator.merge"],
+    "merge --version": [sys.executable, "-c", "from mergeinator.merge import cli; cli()",
+                        "--version"],
+    "merge --help": [sys.executable, "-c", "from mergeinator.merge import cli; cli()", "--help"],
+    "python (baseline)": [sys.executable, "-c", "pass"],
+}
+
+
+def time_it(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for name, cmd in CASES.items():
+        best, median = time_it(cmd, runs)
+        print(f"{name:26} best {best * 1000:7.1f} ms   median {median * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
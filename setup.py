@@ -5,7 +5,7 @@ from os.path import splitext, basename
 
 setup(
     name='mergeinator',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     version='0.6',
     license='GPL v2',
     description='The Mergeinator.',
@@ -29,7 +29,6 @@ setup(
         'Operating System :: Microsoft :: Windows',
         'Operating System :: MacOS',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 
-from .logs import WHT, GRN, YEL, RED, BLD, BLDWHT, BLDRED, NORMAL, RESET, DIM
-from .mergeinator import do_merge, move_maybe
-from .mergeinator import _dmark
+# Exported names are imported on first use, so that the CLI doesn't pay
+# for colored, subprocess, etc. just to print --help or --version.
+_exports = {
+    "WHT": ".logs", "GRN": ".logs", "YEL": ".logs", "RED": ".logs", "BLD": ".logs",
+    "BLDWHT": ".logs", "BLDRED": ".logs", "NORMAL": ".logs", "RESET": ".logs", "DIM": ".logs",
+    "do_merge": ".mergeinator", "move_maybe": ".mergeinator", "_dmark": ".mergeinator",
+    "MergeSession": ".session",
+    "nice_size": ".nicer", "nice_delta": ".nicer",
+}
 
-from .nicer import nice_size, nice_delta
+__all__ = sorted(_exports)
 
-# Shut up pyflakes' F401 with explicit list of exported names
-__all__ = {WHT, GRN, YEL, RED, BLD, BLDWHT, BLDRED, NORMAL, RESET, DIM, do_merge, _dmark}
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,255 @@
+"""Content comparison that's gentle on the page cache.
+
+Comparing two multi-GB files with diff reads both through the page cache
+and pushes everything else out of it.  compare_files() reads big,
+aligned blocks, tells the kernel (posix_fadvise) that it's reading
+sequentially and won't need the pages again, and stops at the first
+difference.
+
+For trees restored from a tarball, where matching size and mtime almost
+always means matching content, files_identical() can instead trust the
+metadata and read only a random sample of pairs.
+"""
+
+import os
+import stat
+import sys
+
+from .listing import merge_join
+from .sparse import data_extents, is_sparse, union_extents
+from .trash import TRASH_NAME
+
+KB = 1024
+MB = 1024 * KB
+
+# Block size bounds.  Reads are the size the device asks for (see
+# _sysfs_io_size()), or DEFAULT_BLOCK if it doesn't say, kept between
+# MIN_BLOCK (not too many syscalls) and MAX_BLOCK (two blocks are in memory
+# at once).
+MIN_BLOCK = 64 * KB
+DEFAULT_BLOCK = 1 * MB
+MAX_BLOCK = 16 * MB
+
+# fcntl command to bypass the unified buffer cache on MacOS, which has no
+# posix_fadvise().
+F_NOCACHE = 48
+
+
+def _sysfs_io_size(st_dev):
+    """Return the I/O size Linux reports for the device, or 0 if it doesn't.
+
+    That's optimal_io_size (e.g. a RAID stripe) if the device has one,
+    otherwise max_sectors_kb, the largest request it's sent in one go.
+    """
+    queue = f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}"
+    for attr, unit in [("optimal_io_size", 1), ("max_sectors_kb", KB)]:
+        # Partitions don't have a queue directory, their parent disk does.
+        for path in [f"{queue}/queue/{attr}", f"{queue}/../queue/{attr}"]:
+            try:
+                with open(path) as f:
+                    value = int(f.read()) * unit
+            except (OSError, ValueError):
+                continue
+            if value:
+                return value
+            break
+    return 0
+
+
+def block_size(session, st):
+    """Return the read size to use for a file on st's device (cached per device)."""
+
+    def compute():
+        align = st.st_blksize or 4 * KB
+        size = _sysfs_io_size(st.st_dev) if sys.platform == "linux" else 0
+        size = min(max(size or DEFAULT_BLOCK, MIN_BLOCK), MAX_BLOCK)
+        # Round up to a multiple of the filesystem block so reads stay aligned
+        return -(-size // align) * align
+
+    return session.cached(("block_size", st.st_dev), compute)
+
+
+class _Reader:
+    """Sequential, cache-dropping reads of one file."""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        elif sys.platform == "darwin":
+            import fcntl
+            fcntl.fcntl(self.fd, F_NOCACHE, 1)
+
+    def pread(self, offset, size):
+        data = os.pread(self.fd, size, offset)
+        if hasattr(os, "posix_fadvise") and data:
+            os.posix_fadvise(self.fd, offset, len(data), os.POSIX_FADV_DONTNEED)
+        return data
+
+    def close(self):
+        os.close(self.fd)
+
+
+def compare_files(session, f1, f2, tick=None):
+    """Return True iff regular files f1 and f2 have the same content.
+
+    Stops at the first differing block.  If either file is sparse, only
+    the regions where at least one of them has data are read: holes read
+    as zeros, so a hole matches written zeros.  Bytes read are added to
+    session.stats["bytes_read"].  tick(), if given, is called once per
+    block so callers can show progress.
+    """
+    st1 = os.stat(f1)
+    st2 = os.stat(f2)
+    if st1.st_size != st2.st_size:
+        return False
+    size = max(block_size(session, st1), block_size(session, st2))
+    r1 = _Reader(f1)
+    try:
+        r2 = _Reader(f2)
+        try:
+            if is_sparse(st1) or is_sparse(st2):
+                regions = union_extents(data_extents(r1.fd, st1.st_size),
+                                        data_extents(r2.fd, st2.st_size))
+                session.log(f"Sparse: comparing {len(regions)} data regions of {f1}")
+            else:
+                regions = [(0, st1.st_size)]
+            for start, end in regions:
+                offset = start
+                while offset < end:
+                    b1 = r1.pread(offset, min(size, end - offset))
+                    b2 = r2.pread(offset, min(size, end - offset))
+                    session.count("bytes_read", len(b1) + len(b2))
+                    if tick is not None:
+                        tick()
+                    if b1 != b2:
+                        return False
+                    if not b1:
+                        # Both got shorter while we were reading
+                        break
+                    offset += len(b1)
+            return True
+        finally:
+            r2.close()
+    finally:
+        r1.close()
+
+
+def _kind(mode):
+    if stat.S_ISDIR(mode):
+        return "dir"
+    if stat.S_ISREG(mode):
+        return "file"
+    if stat.S_ISLNK(mode):
+        return "link"
+    return "other"
+
+
+def _same_mtime(st1, st2):
+    """Return True if the mtimes match, to the second if either has no fraction.
+
+    Tar (ustar) only keeps whole seconds, so an extracted copy of a file
+    won't match the original's nanoseconds.
+    """
+    if st1.st_mtime_ns == st2.st_mtime_ns:
+        return True
+    whole = st1.st_mtime_ns % 10**9 == 0 or st2.st_mtime_ns % 10**9 == 0
+    return whole and st1.st_mtime_ns // 10**9 == st2.st_mtime_ns // 10**9
+
+
+def policy_verdict(session, path, st1, st2, first_difference, root=None, unread=True):
+    """Decide whether path matches another copy of it, by the session's policy.
+
+    st1 and st2 are their stats (only st_size and st_mtime_ns are used),
+    and first_difference() reads both, returning None if they match or
+    whatever describes the difference.  Returns None if they match, else
+    that, or unread if they differ in size and weren't read.
+
+    Logs which policy ("size", "metadata", "sample" or "full") decided the
+    verdict.  A sampled pair that differs escalates root (default path)
+    to full verification.
+    """
+    if st1.st_size != st2.st_size:
+        policy, difference = "size", unread
+    elif (not session.trust_metadata or not _same_mtime(st1, st2)
+          or session.is_escalated(path)):
+        policy, difference = "full", first_difference()
+    elif session.should_sample():
+        policy, difference = "sample", first_difference()
+        if difference is not None:
+            session.ui(f"Sampled {path} differs despite matching size and mtime.  "
+                       f"Verifying everything under {root or path}.")
+            session.escalate(root or path)
+    else:
+        policy, difference = "metadata", None
+    session.count(f"{policy}_verdicts")
+    session.log(f"{path}: {'identical' if difference is None else 'differs'} "
+                f"(decided by {policy})")
+    return difference
+
+
+def files_identical(session, f1, f2, st1, st2, root=None, tick=None):
+    """Decide whether regular files f1 and f2 match, by the session's policy.
+
+    See policy_verdict().
+    """
+    def first_difference():
+        return None if compare_files(session, f1, f2, tick) else True
+
+    return policy_verdict(session, f1, st1, st2, first_difference, root) is None
+
+
+def compare_paths(session, p1, p2, tick=None, root=None):
+    """Return True iff p1 and p2 are the same: like `diff -r --no-dereference -q`.
+
+    Symlinks are compared by target, directories recursively (stopping at
+    the first difference), and other special files by type only.
+    Permission differences don't count.  Regular files are compared
+    according to the session's policy (see files_identical()).
+    """
+    if root is None:
+        root = p1
+    try:
+        st1 = os.lstat(p1)
+        st2 = os.lstat(p2)
+        k1 = _kind(st1.st_mode)
+        k2 = _kind(st2.st_mode)
+        if k1 != k2:
+            session.log(f"{p1} is a {k1}, {p2} is a {k2}")
+            return False
+        if k1 == "link":
+            return os.readlink(p1) == os.readlink(p2)
+        if k1 == "file":
+            return files_identical(session, p1, p2, st1, st2, root, tick)
+        if k1 == "dir":
+            return compare_trees(session, p1, p2, tick, root)
+    except PermissionError as e:
+        session.ui(f"Permission error comparing {p1} and {p2}: {e}")
+        session.ui("Continuing after permission error.")
+        return False
+    return True
+
+
+def compare_trees(session, d1, d2, tick=None, root=None):
+    """Return True iff directories d1 and d2 have the same names and contents.
+
+    Names matching the session's junk rules don't count.  A name in d1
+    matching a prune rule, or a trash directory, makes them differ: it's
+    to be left alone, so d1 mustn't be deleted as a duplicate along with
+    it.
+    """
+    for name, in1, in2 in merge_join(d1, d2):
+        rule = "prune" if name == TRASH_NAME else session.rules.classify(name)
+        if rule == "prune" and in1:
+            session.log(f"{os.path.join(d1, name)} is pruned, so {d1} isn't a duplicate")
+            return False
+        if rule:
+            continue
+        if not (in1 and in2):
+            session.log(f"{name} is only in {d1 if in1 else d2}")
+            return False
+        if not compare_paths(session, os.path.join(d1, name), os.path.join(d2, name), tick,
+                             root or d1):
+            session.log(f"{os.path.join(d1, name)} differs")
+            return False
+    return True
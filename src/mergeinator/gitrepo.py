@@ -0,0 +1,325 @@
+"""Compare git repositories by history rather than by bytes.
+
+Two copies of a repository can hold exactly the same history while
+their .git directories differ completely, e.g. when one has been gc'd
+into a packfile and the other still has loose objects.  This reads the
+refs and objects directly (no git binary, no network) and walks the
+source's history in the destination's object store, to decide whether
+the destination already has everything the source has.
+
+Only refs and objects count: config, hooks, the index and reflogs are
+not compared.
+"""
+
+import os
+import struct
+import zlib
+
+IDX_V2_MAGIC = b"\377tOc"
+# Pack entry types; 5 is unused
+PACK_TYPES = [None, "commit", "tree", "blob", "tag"]
+OFS_DELTA, REF_DELTA = 6, 7
+# Tree entry mode of a submodule commit, which lives in another repository
+GITLINK_MODE = b"160000"
+
+# What compare_repos() verdicts mean, for the UI
+REPO_VERDICTS = {
+    "identical": "Same refs, and the destination has all of their history.",
+    "contains": "Destination has all of its history.",
+}
+
+
+def is_git_dir(path):
+    """Return True if path looks like a .git directory or a bare foo.git repo."""
+    return (path.rstrip("/").endswith(".git") and os.path.isfile(os.path.join(path, "HEAD"))
+            and os.path.isdir(os.path.join(path, "objects"))
+            and os.path.isdir(os.path.join(path, "refs")))
+
+
+def _read_ref_file(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def read_refs(git_dir):
+    """Return {refname: object id (or "ref: <target>" if symbolic)} for git_dir.
+
+    Includes HEAD, packed-refs, and loose refs (which override packed ones).
+    """
+    refs = {}
+    try:
+        with open(os.path.join(git_dir, "packed-refs")) as f:
+            for line in f:
+                # Comments are "# pack-refs with:", peeled tags are "^<id>"
+                if line.startswith(("#", "^")):
+                    continue
+                oid, _, name = line.strip().partition(" ")
+                if name:
+                    refs[name] = oid
+    except FileNotFoundError:
+        pass
+    refs_dir = os.path.join(git_dir, "refs")
+    for root, dirs, files in os.walk(refs_dir):
+        for fname in files:
+            path = os.path.join(root, fname)
+            name = os.path.relpath(path, git_dir).replace(os.sep, "/")
+            refs[name] = _read_ref_file(path)
+    refs["HEAD"] = _read_ref_file(os.path.join(git_dir, "HEAD"))
+    return refs
+
+
+def _idx_offset(idx_path, oid):
+    """Return where object oid (bytes) starts in the pack for idx_path, or None."""
+    with open(idx_path, "rb") as f:
+        header = f.read(8)
+        if header[:4] == IDX_V2_MAGIC:
+            fanout_at = 8
+            entry_size, name_at = len(oid), 0
+        else:
+            # Version 1: no header, entries are a 4 byte offset then the name
+            fanout_at = 0
+            entry_size, name_at = 4 + len(oid), 4
+        f.seek(fanout_at)
+        fanout = struct.unpack(">256I", f.read(256 * 4))
+        entries_at = fanout_at + 256 * 4
+        # fanout[b] is the number of objects whose first byte is <= b
+        lo = fanout[oid[0] - 1] if oid[0] > 0 else 0
+        hi = fanout[oid[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(entries_at + mid * entry_size + name_at)
+            name = f.read(len(oid))
+            if name < oid:
+                lo = mid + 1
+            elif name > oid:
+                hi = mid
+            elif name_at:
+                f.seek(entries_at + mid * entry_size)
+                return struct.unpack(">I", f.read(4))[0]
+            else:
+                # Version 2: names, then CRCs, then offsets, then large offsets
+                count = fanout[255]
+                f.seek(entries_at + count * (len(oid) + 4) + mid * 4)
+                offset = struct.unpack(">I", f.read(4))[0]
+                if offset & 0x80000000:
+                    f.seek(entries_at + count * (len(oid) + 8) + (offset & 0x7FFFFFFF) * 8)
+                    offset = struct.unpack(">Q", f.read(8))[0]
+                return offset
+    return None
+
+
+def _object_dirs(git_dir):
+    """Return the object directories for git_dir, including alternates."""
+    objects = os.path.join(git_dir, "objects")
+    dirs = [objects]
+    try:
+        with open(os.path.join(objects, "info", "alternates")) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    dirs.append(os.path.normpath(os.path.join(objects, line)))
+    except FileNotFoundError:
+        pass
+    return dirs
+
+
+def _apply_delta(base, delta):
+    """Return the object git's delta encoding builds from base."""
+    pos = 0
+    for _ in range(2):
+        # Source and target sizes, little-endian base 128
+        while delta[pos] & 0x80:
+            pos += 1
+        pos += 1
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy from base: which offset and size bytes follow is in op's low bits
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (1 << (4 + i)):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        else:
+            out += delta[pos:pos + op]
+            pos += op
+    return bytes(out)
+
+
+class _ObjectStore:
+    """Read access to a git directory's objects, loose or packed."""
+
+    def __init__(self, git_dir):
+        self.dirs = _object_dirs(git_dir)
+        self.packs = []
+        for objects in self.dirs:
+            pack_dir = os.path.join(objects, "pack")
+            try:
+                names = sorted(os.listdir(pack_dir))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                pack = os.path.join(pack_dir, name[:-len(".idx")] + ".pack")
+                # An index is no use without its pack
+                if name.endswith(".idx") and os.path.isfile(pack):
+                    self.packs.append((os.path.join(pack_dir, name), pack))
+
+    def _find(self, oid):
+        """Return ("loose", path) or ("packed", (pack, offset)) for oid, or None."""
+        for objects in self.dirs:
+            path = os.path.join(objects, oid[:2], oid[2:])
+            if os.path.isfile(path):
+                return "loose", path
+        raw = bytes.fromhex(oid)
+        for idx, pack in self.packs:
+            offset = _idx_offset(idx, raw)
+            if offset is not None:
+                return "packed", (pack, offset)
+        return None
+
+    def has(self, oid):
+        try:
+            return self._find(oid) is not None
+        except ValueError:
+            return False
+
+    def read(self, oid):
+        """Return (type, data) for oid, type being "commit", "tree", "blob" or "tag".
+
+        Raises KeyError if it isn't there, and OSError, ValueError or
+        zlib.error if it can't be read.
+        """
+        where = self._find(oid)
+        if where is None:
+            raise KeyError(oid)
+        kind, place = where
+        if kind == "loose":
+            with open(place, "rb") as f:
+                raw = zlib.decompress(f.read())
+            header, _, data = raw.partition(b"\0")
+            return header.split(b" ")[0].decode(), data
+        pack, offset = place
+        with open(pack, "rb") as f:
+            type_num, data = self._read_packed(f, offset, len(oid) // 2)
+        return PACK_TYPES[type_num], data
+
+    def _read_packed(self, f, offset, oid_size):
+        """Return (type number, data) for the pack entry at offset, with deltas applied."""
+        f.seek(offset)
+        byte = f.read(1)[0]
+        type_num = (byte >> 4) & 7
+        while byte & 0x80:
+            byte = f.read(1)[0]
+        base = None
+        if type_num == OFS_DELTA:
+            byte = f.read(1)[0]
+            back = byte & 0x7F
+            while byte & 0x80:
+                byte = f.read(1)[0]
+                back = ((back + 1) << 7) | (byte & 0x7F)
+            at = f.tell()
+            type_num, base = self._read_packed(f, offset - back, oid_size)
+            f.seek(at)
+        elif type_num == REF_DELTA:
+            base_oid = f.read(oid_size).hex()
+            type_name, base = self.read(base_oid)
+            type_num = PACK_TYPES.index(type_name)
+        elif not 1 <= type_num <= 4:
+            raise ValueError(f"Unknown pack object type {type_num}")
+        inflate = zlib.decompressobj()
+        data = b""
+        while not inflate.eof:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                raise ValueError("Truncated pack entry")
+            data += inflate.decompress(chunk)
+        return type_num, data if base is None else _apply_delta(base, data)
+
+
+def _read_shallow(git_dir):
+    """Return the commits git_dir's history is cut off at, if it's a shallow clone."""
+    try:
+        with open(os.path.join(git_dir, "shallow")) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def _first_missing(store, tips, shallow=frozenset()):
+    """Return an object reachable from tips that store lacks or can't read, or None.
+
+    Walks every commit, tag, and tree from tips, and checks every blob
+    they list is there.  Parents of shallow commits aren't followed.
+    """
+    seen = set()
+    todo = list(tips)
+    while todo:
+        oid = todo.pop()
+        if oid in seen:
+            continue
+        seen.add(oid)
+        try:
+            kind, data = store.read(oid)
+        except (KeyError, OSError, ValueError, IndexError, zlib.error):
+            return oid
+        if kind == "commit":
+            for line in data.split(b"\n"):
+                if not line:
+                    break
+                key, _, value = line.partition(b" ")
+                if key == b"tree" or (key == b"parent" and oid not in shallow):
+                    todo.append(value.decode())
+        elif kind == "tag":
+            todo.append(data.split(b"\n")[0].partition(b" ")[2].decode())
+        elif kind == "tree":
+            # Entries are "<mode> <name>\0<raw object id>"
+            pos, size = 0, len(oid) // 2
+            while pos < len(data):
+                space = data.index(b" ", pos)
+                nul = data.index(b"\0", space)
+                mode, entry = data[pos:space], data[nul + 1:nul + 1 + size].hex()
+                pos = nul + 1 + size
+                if mode == b"40000":
+                    todo.append(entry)
+                elif mode != GITLINK_MODE and entry not in seen:
+                    seen.add(entry)
+                    if not store.has(entry):
+                        return entry
+    return None
+
+
+def compare_repos(session, src, dest):
+    """Compare git directories src and dest by refs and history.
+
+    Returns "identical" if they have the same refs, "contains" if they
+    don't, or None if either isn't a git directory.  Either way dest
+    must have every commit, tree, and blob reachable from src's refs,
+    or it's None too.
+    """
+    if not (is_git_dir(src) and is_git_dir(dest)):
+        return None
+    src_refs = read_refs(src)
+    dest_refs = read_refs(dest)
+    if os.path.exists(os.path.join(dest, "shallow")) and \
+            not os.path.exists(os.path.join(src, "shallow")):
+        # A shallow dest may have src's tips but not their ancestors
+        verdict = None
+    else:
+        # Even with the same refs, dest's objects may be missing (an
+        # interrupted copy), so check they're all really there
+        tips = [oid for oid in src_refs.values() if not oid.startswith("ref: ")]
+        missing = _first_missing(_ObjectStore(dest), tips, _read_shallow(src))
+        if missing is None:
+            verdict = "identical" if src_refs == dest_refs else "contains"
+        else:
+            session.log(f"{dest} lacks {missing}, which {src} has")
+            verdict = None
+    session.log(f"Git comparison of {src} and {dest}: {verdict}")
+    return verdict
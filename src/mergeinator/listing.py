@@ -0,0 +1,105 @@
+"""Streaming directory listings for directories with huge numbers of entries.
+
+merge_join() walks the sorted listings of a source and a destination
+directory side by side, so each name is classified as source-only,
+destination-only, or both in one linear pass, without a lookup per
+name.  Listings longer than RUN_SIZE are sorted in runs that are
+spilled to temporary files and merged, so memory holds at most
+RUN_SIZE names per directory however big it is.
+
+Each function takes an optional overlay.Overlay, for dry runs: the
+listing is then of the directory as it would be after the planned
+moves and deletes.
+"""
+
+import heapq
+import os
+import tempfile
+
+RUN_SIZE = 100_000
+READ_SIZE = 64 * 1024
+
+
+def _spill(names):
+    """Write sorted names to a temp file, NUL separated (NUL can't be in a name)."""
+    f = tempfile.TemporaryFile()
+    for name in names:
+        f.write(os.fsencode(name) + b"\0")
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    tail = b""
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            return
+        names = (tail + chunk).split(b"\0")
+        tail = names.pop()
+        for name in names:
+            yield os.fsdecode(name)
+
+
+def sorted_names(path, run_size=RUN_SIZE, overlay=None):
+    """Yield the names in directory path in sorted order."""
+    if overlay is not None:
+        yield from _overlaid_names(path, run_size, overlay)
+        return
+    runs = []
+    names = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                names.append(entry.name)
+                if len(names) >= run_size:
+                    names.sort()
+                    runs.append(_spill(names))
+                    names = []
+        names.sort()
+        if runs:
+            yield from heapq.merge(*[_read_run(f) for f in runs], names)
+        else:
+            yield from names
+    finally:
+        for f in runs:
+            f.close()
+
+
+def _overlaid_names(path, run_size, overlay):
+    real = overlay.resolve(path)
+    if real is None or not os.path.isdir(real):
+        return
+    hidden, extra = overlay.changes(path)
+    last = None
+    for name in heapq.merge(sorted_names(real, run_size), extra):
+        if name != last and name not in hidden:
+            yield name
+        last = name
+
+
+def merge_join(src_dir, dest_dir, run_size=RUN_SIZE, overlay=None):
+    """Yield (name, in_src, in_dest) for every name in either directory, in sorted order."""
+    src = sorted_names(src_dir, run_size, overlay)
+    dest = sorted_names(dest_dir, run_size, overlay)
+    s = next(src, None)
+    d = next(dest, None)
+    while s is not None or d is not None:
+        if d is None or (s is not None and s < d):
+            yield s, True, False
+            s = next(src, None)
+        elif s is None or d < s:
+            yield d, False, True
+            d = next(dest, None)
+        else:
+            yield s, True, True
+            s = next(src, None)
+            d = next(dest, None)
+
+
+def has_entries(path, overlay=None):
+    """Return True if directory path has at least one entry."""
+    if overlay is not None:
+        return next(_overlaid_names(path, RUN_SIZE, overlay), None) is not None
+    with os.scandir(path) as it:
+        return next(it, None) is not None
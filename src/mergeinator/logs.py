@@ -2,6 +2,7 @@ from colored import fg, style
 from os import environ, path
 from sys import stdout
 from datetime import datetime as dt
+from threading import Lock
 
 # Let's use ANSI escape sequence colors if we're on a tty
 if stdout.isatty() or ('TERM' in environ and 'color' in environ['TERM']):
@@ -27,12 +28,21 @@ BLDWHT = BLD + WHT
 BLDRED = BLD + RED
 
 
-def log(*args, **kwargs):
+# Sessions running in different threads may share a logfile
+_log_lock = Lock()
+
+
+def write_log(logfile, *args, **kwargs):
     mode = "w+"
-    if path.isfile("merge.log"):
-        mode = "a"
-    with open("merge.log", mode) as global_log:
-        print(dt.now().isoformat(), *args, file=global_log, **kwargs)
+    with _log_lock:
+        if path.isfile(logfile):
+            mode = "a"
+        with open(logfile, mode) as global_log:
+            print(dt.now().isoformat(), *args, file=global_log, **kwargs)
+
+
+def log(*args, **kwargs):
+    write_log("merge.log", *args, **kwargs)
 
 
 def ui(*args, **kwargs):
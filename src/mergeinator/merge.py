@@ -1,21 +1,51 @@
 #!/usr/bin/env python3
 """CLI wrapper for mergeinator()"""
 
-from click import command, argument, option, version_option, echo, Path
-import pkg_resources  # For version number
+from click import command, argument, option, version_option, echo, FloatRange, Path, UsageError
 from os.path import abspath, exists, isfile, isdir, basename
 from sys import exit
 
-from mergeinator import WHT, NORMAL, do_merge, move_maybe
+
+def _version():
+    # importlib.metadata is much quicker to import than pkg_resources
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python 3.7
+        import pkg_resources
+        return pkg_resources.require("mergeinator")[0].version
+    return version("mergeinator")
 
 
 @command()
 @argument("source", type=Path())
-@argument("destination", type=Path())
+@argument("destination", type=Path(), required=False)
 @option("-n", "--dryrun", help="Don't change anything", is_flag=True)
 @option("-y", "--yes", help="force answer of yes to questions.", is_flag=True)
+@option("--trust-metadata", is_flag=True,
+        help="Treat files with the same size and mtime as identical without reading them all.")
+@option("--sample", type=FloatRange(0, 1), default=0.05, show_default=True, metavar="FRACTION",
+        help="With --trust-metadata, fraction of matching files to read anyway.")
+@option("--prune", multiple=True, metavar="GLOB",
+        help="Leave entries named GLOB alone: don't descend, compare, or move them.")
+@option("--junk", multiple=True, metavar="GLOB",
+        help="Offer to delete entries named GLOB without comparing them.")
+@option("--rules", type=Path(exists=True, dir_okay=False), metavar="FILE",
+        help="Read prune/junk rules from FILE.")
+@option("--trash", is_flag=True,
+        help="Delete by moving into a trash directory (instant), and purge it later.")
+@option("--largest-first", is_flag=True,
+        help="Handle whatever frees the most space first, across all levels.")
+@option("--budget", multiple=True, metavar="AMOUNT",
+        help="Stop after a time (e.g. 30m, 2h) or after freeing some space (e.g. 50GB).")
+@option("--no-unpack", is_flag=True,
+        help="Move a tar SOURCE like any other file instead of merging its contents.")
+@option("--self", "self_dedup", is_flag=True,
+        help="Find duplicates within SOURCE itself (no DESTINATION).")
+@option("--undo", is_flag=True, help="Restore what the last --trash run deleted near SOURCE.")
+@option("--purge", is_flag=True, help="Empty the trash on SOURCE's filesystem.")
 @version_option()
-def cli(source, destination, dryrun, yes):
+def cli(source, destination, dryrun, yes, trust_metadata, sample, prune, junk, rules, trash,
+        largest_first, budget, no_unpack, self_dedup, undo, purge):
     """Merge helps get rid of duplicate files and directory trees.
 
     If source and destination are both files, and the destination file
@@ -30,27 +60,117 @@ def cli(source, destination, dryrun, yes):
 
     If the source and destination are both directories, it will trim
     away the source directory by moving its unique content into the
-    destination directory.  Duplicate content is discarded.  It may
-    require multiple runs of merge (one per level of subdirectory
-    depth) to completely remove all duplicate content because merge
-    won't remove non-empty directories, and duplicate directories
-    don't become empty until after they are merged.
+    destination directory.  Duplicate content is discarded.  When
+    merging a subdirectory leaves it empty, merge offers to delete it,
+    so one run removes all the duplicate content, however deep.
+
+    With --dryrun, nothing is changed and nothing is asked: each
+    question gets its default answer (or yes, with --yes), and the
+    planned moves and deletes are tracked in memory, so the dry run
+    shows everything a real run would do, at every level.
 
     If the source is a directory and the destination is a file, you're
     holding it wrong.
+
+    If the source is a tar archive (named .tar, .tgz, .tar.gz, .tar.xz,
+    ...) and the destination is a directory, the archive is read once, as
+    a stream, and only the members the destination lacks (or has
+    different copies of) are extracted.  Nothing is written for members
+    that match.  With --no-unpack, the archive is moved like any other
+    file.
+
+    With --trust-metadata, files with the same size and modification
+    time (e.g., both restored from tarballs) are assumed identical,
+    except for a random sample that is compared anyway.  If a sampled
+    file differs, everything under that comparison is compared in full.
+    merge.log records which rule decided each file.
+
+    --prune and --junk take shell globs matched against file and
+    directory names (e.g. --junk .DS_Store --prune node_modules).  A
+    --rules file holds one "prune: GLOB" or "junk: GLOB" per line.
+
+    With --trash, deleting is just a rename into .merge-trash at the top
+    of the filesystem (or the highest directory you can write), so you
+    don't wait for big deletes.  The previous run's trash is purged in
+    the background at idle priority.  "merge --undo PATH" restores what
+    the last run on PATH's filesystem deleted, and "merge --purge PATH"
+    empties the trash now.
+
+    "merge --self DIR" looks for duplicates inside DIR itself: files and
+    whole directories with the same content at different paths.  They're
+    found by size, then a digest of their first 64KB, then a full digest
+    (kept in a temporary on-disk index, so millions of files are fine),
+    and reported at the highest level where they match.  merge offers to
+    delete each extra copy.
+
+    --largest-first does a quick size scan of the source, then works
+    through entries in order of how much space handling them should free,
+    opening up directories as it goes.  --budget stops the run after a
+    time or amount of space, so a limited session frees the most it can.
     """
-    my_version = pkg_resources.require("mergeinator")[0].version
-    echo(f"Mergeinator {my_version}")
+    # Imported here so --help and --version don't have to wait for them
+    from mergeinator import WHT, NORMAL, MergeSession, do_merge, move_maybe, nice_size
+    from mergeinator.rules import Rules
+    from mergeinator.schedule import parse_budget
+    from mergeinator.tarsource import is_tar_source, merge_tar
+
+    echo(f"Mergeinator {_version()}")
+    if undo or purge:
+        from mergeinator.trash import undo as undo_trash, purge as purge_trash
+        session = MergeSession(source)
+        if undo:
+            undo_trash(session, source)
+        if purge:
+            purge_trash(session, source)
+        exit(0)
+    if self_dedup and destination is not None:
+        raise UsageError("--self takes just one directory.")
+    if destination is None and not self_dedup:
+        raise UsageError("Missing argument 'DESTINATION'.")
+    budget_seconds = budget_bytes = None
+    for amount in budget:
+        try:
+            seconds, size = parse_budget(amount)
+        except ValueError as e:
+            raise UsageError(str(e))
+        budget_seconds = seconds if seconds is not None else budget_seconds
+        budget_bytes = size if size is not None else budget_bytes
     if not exists(source):
         echo(f"{WHT}{source}{NORMAL} doesn't exist.  My work here is done.")
         exit(0)
-    echo(f"Merging {WHT}{source}{NORMAL} to {WHT}{destination}{NORMAL}\n")
-    echo(f"Full paths: {abspath(source)} to {abspath(destination)}\n")
-    if isfile(source) and isfile(destination):
-        move_maybe(source, destination, yes_flag=yes, dry_run_flag=dryrun)
+    if self_dedup:
+        destination = source
+        echo(f"Looking for duplicates within {WHT}{source}{NORMAL}\n")
+    else:
+        echo(f"Merging {WHT}{source}{NORMAL} to {WHT}{destination}{NORMAL}\n")
+        echo(f"Full paths: {abspath(source)} to {abspath(destination)}\n")
+    if rules:
+        ignore = Rules.from_file(rules, prune=prune, junk=junk)
+    else:
+        ignore = Rules(prune=prune, junk=junk)
+    session = MergeSession(destination, yes=yes, dry_run=dryrun, trust_metadata=trust_metadata,
+                           sample_rate=sample, rules=ignore, trash=trash,
+                           largest_first=largest_first, budget_seconds=budget_seconds,
+                           budget_bytes=budget_bytes)
+    archive = not no_unpack and isdir(destination) and is_tar_source(source)
+    if self_dedup:
+        from mergeinator.selfdedup import dedup
+        dedup(session, source)
+    elif archive:
+        merge_tar(session, source)
+    elif isfile(source) and isfile(destination):
+        move_maybe(source, destination, session=session)
     elif isfile(source) and isdir(destination):
-        move_maybe(source, destination + basename(source), yes_flag=yes, dry_run_flag=dryrun)
+        move_maybe(source, destination + basename(source), session=session)
     elif isdir(source) and isdir(destination):
-        do_merge(source, destination, 0, yes_flag=yes, dry_run_flag=dryrun)
+        do_merge(source, destination, 0, yes_flag=yes, dry_run_flag=dryrun, session=session)
     else:
         echo(f"I'm not prepared for whatever {source} and {destination} are.")
+    if dryrun and not archive:
+        session.ui(f"Dry run: would move {session.stats['moved']} entries "
+                   f"({nice_size(session.stats['bytes_moved'])}) and delete "
+                   f"{session.stats['removed']} "
+                   f"({nice_size(session.stats['bytes_freed'])}).")
+    if session.stats["bytes_read"]:
+        session.ui(f"Read {nice_size(session.stats['bytes_read'])} comparing files.")
+    session.close()
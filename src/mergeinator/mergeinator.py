@@ -8,42 +8,37 @@ import sys
 from stat import S_IRUSR, S_IWUSR, S_IXUSR
 
 from datetime import datetime as dt
-from subprocess import run, PIPE, Popen, TimeoutExpired
+from subprocess import run
 
-from .logs import BLD, GRN, WHT, YEL, RED, NORMAL, DIM, log, ui
+from .logs import WHT, YEL, RED, NORMAL, DIM
+from .compare import compare_paths
+from .gitrepo import REPO_VERDICTS, compare_repos
+from .listing import has_entries, merge_join
 from .nicer import nice_delta, nice_size
+from .schedule import release
+from .session import MergeSession
+from .sparse import sparse_copy2
+from .trash import TRASH_NAME, trash
 
 DIFF_PATH = ['/usr/local/bin/diff', '/opt/homebrew/bin/diff', '/usr/bin/diff']
-for p in DIFF_PATH:
-    if os.access(p, os.X_OK):
-        DIFF = p
-        break
-
-
-def answer(question):
-    global force_yes
-    global dry_run
-    retval = 'n'
-    if dry_run:
-        print(question, BLD + GRN + "n" + NORMAL)
-    if force_yes:
-        print(question, BLD + RED + "y" + NORMAL)
-        retval = 'y'
-    else:
-        retval = str.lower(input(question))
-    log(question, retval)
-    return retval
 
 
-def not_dead_gen():
+def find_diff():
+    """Return the first usable diff on DIFF_PATH (GNU diff preferred)."""
+    for p in DIFF_PATH:
+        if os.access(p, os.X_OK):
+            return p
+    return "diff"
+
+
+def not_dead_gen(session):
     """I'm not dead, Jim"""
     spinner_state = 0
     spinner_map = ['|', '/', '-', '\\']
 
     while True:
         # Two chars so spinner doesn't end up under cursor
-        print(f" {spinner_map[spinner_state]}\b\b", end='')
-        sys.stdout.flush()
+        session.echo(f" {spinner_map[spinner_state]}\b\b", end='', flush=True)
         spinner_state = (spinner_state + 1) % len(spinner_map)
         yield
 
@@ -53,12 +48,12 @@ def filestr(path, color=WHT):
     return f'{color}"{path}"{NORMAL}'
 
 
-def unstick(file):
+def unstick(session, file):
     """Make FILE readable and deleteable, or die trying."""
 
     def my_run(cmd, path):
         cmd_str = " ".join(cmd)
-        ui(f"Running {WHT}{cmd_str} {filestr(path)}")
+        session.ui(f"Running {WHT}{cmd_str} {filestr(path)}")
         result = run(cmd + [path])
         return result
 
@@ -73,7 +68,7 @@ def unstick(file):
             os.chmod(path, mode | RW, follow_symlinks=False)
             new_mode = os.stat(path, follow_symlinks=False).st_mode
             if not new_mode & RW == RW:
-                ui(f"{RED}chmod +rw failed: {filestr(path)}")
+                session.ui(f"{RED}chmod +rw failed: {filestr(path)}")
                 sys.exit(1)
 
     def make_rwx(path):
@@ -84,7 +79,7 @@ def unstick(file):
             os.chmod(path, mode | RWX, follow_symlinks=False)
             new_mode = os.stat(path, follow_symlinks=False).st_mode
             if not new_mode & RWX == RWX:
-                ui(f"{RED}chmod +rwx failed: {filestr(path)}")
+                session.ui(f"{RED}chmod +rwx failed: {filestr(path)}")
                 sys.exit(1)
 
     def make_readable(path):
@@ -119,25 +114,25 @@ def unstick(file):
         if len(acls) > 0:
             if len(acls) >= 1 and acls[0] == evil_acl \
                or acls[0] == evil_acl2:
-                log(f"{RED}Fixing evil ACL on {filestr(path)}{NORMAL}")
+                session.log(f"{RED}Fixing evil ACL on {filestr(path)}{NORMAL}")
                 remove_evil_acl(path)
                 return
             my_run(["chmod", "-N"], path)
             acls = get_acls(path)
             if len(acls) > 0:
-                ui(f"Still Evil ACL? {acls}")
+                session.ui(f"Still Evil ACL? {acls}")
                 # Maybe it's the evil ACL which has to be removed individually
                 remove_evil_acl(path)
-                ui(f"This shouldn't have happened ({filestr(path)}).")
+                session.ui(f"This shouldn't have happened ({filestr(path)}).")
                 sys.exit(1)
-            ui(f"ACLs removed from {filestr(path)}.")
+            session.ui(f"ACLs removed from {filestr(path)}.")
 
     def get_xattrs(path):
         result = run(["ls", "-al@d", path], capture_output=True)
         rs = result.stdout.decode()
         xattrs = re.findall(r"^  +.+  +\d+", rs)
         if len(xattrs) > 0:
-            ui(f"{YEL}Xattrs: {xattrs}")
+            session.ui(f"{YEL}Xattrs: {xattrs}")
         return xattrs
 
     def remove_xattrs(path):
@@ -149,8 +144,8 @@ def unstick(file):
             my_run(["xattr", "-cs"], path)
             new_xa = get_xattrs(path)
             if len(new_xa) > 0:
-                ui(f"Remove xattrs failed: {filestr(path, color=RED)}")
-                ui(f" xattrs: {RED}{xa}{NORMAL}")
+                session.ui(f"Remove xattrs failed: {filestr(path, color=RED)}")
+                session.ui(f" xattrs: {RED}{xa}{NORMAL}")
                 sys.exit(1)
 
     def remove_uchg_schg(path):
@@ -167,116 +162,70 @@ def unstick(file):
     #
     # Start of unstick()
     #
+    if session.dry_run:
+        session.ui(f"Would try to fix permissions on {filestr(file)}.")
+        return
     parent = os.path.dirname(file)
-    log(f"Fixing parent ({filestr(parent)}).")
+    session.log(f"Fixing parent ({filestr(parent)}).")
     four_fixes(parent)
 
-    ui(f"Unstick({filestr(file)})")
+    session.ui(f"Unstick({filestr(file)})")
     four_fixes(file)
 
     if os.path.isdir(file) and not os.path.islink(file):
         # Now do it all again for this whole tree
         for root, dirs, files in os.walk(file):
-            not_dead_gen()
+            not_dead_gen(session)
             for dir in dirs:
                 four_fixes(os.path.normpath(os.path.join(root, dir)))
             for file in files:
                 four_fixes(os.path.normpath(os.path.join(root, file)))
-    ui("Unstuck")
+    session.ui("Unstuck")
 
 
-def safe_len(path):
+def safe_len(session, path):
     if not os.path.isdir(path):
-        ui(f"{path} isn't a directory.")
+        session.ui(f"{path} isn't a directory.")
         return -1
     try:
-        listing = os.listdir(path)
+        # Count as we go rather than building the whole listing
+        with os.scandir(path) as it:
+            return sum(1 for entry in it if not session.rules.classify(entry.name))
     except PermissionError as e:
-        ui(f"Couldn't list {path} due to permission error {e}.")
-        unstick(path)
-        ui("It might work to retry the merge now.")
+        session.ui(f"Couldn't list {path} due to permission error {e}.")
+        unstick(session, path)
+        session.ui("It might work to retry the merge now.")
         sys.exit(1)
-    return len(listing)
 
 
-def is_identical(f1, f2):
+def is_identical(session, f1, f2):
     """Return true iff paths f1 and f2 have no diffs.
 
     Don't count permission differences.
-    Prints a spinner while polling the diff for completion.
+    Prints a spinner while comparing.
     """
 
     # If one path is a directory and the other is a file, they aren't identical.
-    # Also, we have to check this case, because diff will fail on it.
     if not os.path.isdir(f1) == os.path.isdir(f2):
-        ui("Weird Case: one dir, one non-dir")
+        session.ui("Weird Case: one dir, one non-dir")
         return False
 
-    # Cheap shortcut: If two directories contain different numbers of items,
-    # they aren't identical.
-    if os.path.isdir(f1) and os.path.isdir(f2):
-        if safe_len(f1) != safe_len(f2):
-            ui(f"{filestr(f1)} has {safe_len(f1)} items, {filestr(f2)} has {safe_len(f2)}.")
-            log(f"{YEL}{os.listdir(f1)}{NORMAL}\n{os.listdir(f2)}")
-            return False
+    # No need to count directory entries first: the comparison joins the two
+    # sorted listings and stops at the first name that's only on one side.
 
-    # Shortcut two: If two files are different lengths, they aren't identical.
+    # Shortcut: If two files are different lengths, they aren't identical.
     if not os.path.isdir(f1) and not os.path.isdir(
             f2) and os.path.getsize(f1) != os.path.getsize(f2):
-        ui(f"Size {os.path.getsize(f1)} != size {os.path.getsize(f2)}")
+        session.ui(f"Size {os.path.getsize(f1)} != size {os.path.getsize(f2)}")
         return False
 
-    not_dead = not_dead_gen()
-
-    ui(f"{DIM}Diff {WHT}{f1}...{NORMAL}")
-    # TODO: If diff doesn't support --no-dereference, print warning that it
-    # will fail on symlinks with no referent.
-    # GNU diff duplicates the last path element if it's a dir with no "/"
-    if os.path.isdir(f1):
-        f1 = f1 + "/"
-    if os.path.isdir(f2):
-        f2 = f2 + "/"
-    cmd = [DIFF, "-r", "--no-dereference", "-q", f1, f2]
-    log(f"{DIM}{WHT}Diff cmd: {cmd}...{NORMAL}")
-    sofar = bytearray(b'')
-    chunk = bytearray(b'')
-    import io
-    # ui(f"io.DEF {io.DEFAULT_BUFFER_SIZE}.")
-    with Popen(cmd, stdout=PIPE, stderr=PIPE, bufsize=100 * io.DEFAULT_BUFFER_SIZE) as p:
-        ret = None
-        # ui("Popened.")
-        while ret is None:
-            try:
-                (chunk, bunk) = p.communicate(timeout=0.25)
-                # ui("Chunk: ", chunk, ".")
-                # ui("Bunk: ", bunk, ".")
-                if len(chunk) > 0:
-                    sofar.extend(chunk)
-                    chunk = bytearray(b'')
-            except TimeoutExpired:
-                # Maybe need to read last chunk?
-                log("waiting on diff")
-                pass
-            # Prints next spinner char
-            next(not_dead)
-            ret = p.poll()
-
-        sofar.extend(chunk)
-        if ret == 2:
-            ui(f"{DIM}{YEL}ret {ret}, output {sofar}{NORMAL}")
-            ui(f"{RED}Diff returned an unexpected error.{NORMAL}.")
-            try:
-                # Sometimes bunk hasn't been set.
-                err_msg = bunk.decode()
-            except UnboundLocalError:
-                err_msg = "Unknown"
-            ui(f"  While running \"{' '.join(cmd)}\", error was:\n"
-               f"  {YEL}{err_msg}{YEL}.\n")
-            if "Permission denied" not in err_msg:
-                sys.exit(1)
-            ui("Continuing after permission error.")
-        # If there is a difference (or an error), ret will be nonzero
-        match = ret == 0
+    not_dead = not_dead_gen(session)
+
+    session.ui(f"{DIM}Compare {WHT}{f1}...{NORMAL}")
+    bytes_before = session.stats["bytes_read"]
+    match = compare_paths(session, f1, f2, tick=lambda: next(not_dead))
+    session.log(f"{DIM}Read {nice_size(session.stats['bytes_read'] - bytes_before)} "
+                f"comparing {f1} and {f2}{NORMAL}")
     return match
 
 
@@ -311,14 +260,14 @@ def _mark(path):
     return path + _dmark(path)
 
 
-def printfiles(f1, f2, mod1, mod2):
+def printfiles(session, f1, f2, mod1, mod2):
     """Print source and destination file with mod1 and mod2.
 
     Args:
         f1, f2: filenames to print.
         mod1, mod2: color/bold/dim modifier
     """
-    ui(f"{mod1}{f1}{_dmark(f1)}{NORMAL} ?--> {mod2}{f2}{_dmark(f2)}{NORMAL}", end="")
+    session.ui(f"{mod1}{f1}{_dmark(f1)}{NORMAL} ?--> {mod2}{f2}{_dmark(f2)}{NORMAL}", end="")
 
 
 def mac_tree_deleter(path):
@@ -332,16 +281,23 @@ def mac_tree_deleter(path):
         run(["rm", path])
 
 
-def remove(path):
+def remove(session, path):
     """Remove path, whether it's a file or a directory (and its contents)."""
+    if session.overlay is not None:
+        real = session.overlay.resolve(path)
+        session.count("removed")
+        session.count("bytes_freed", release(session, real) if real else 0)
+        session.overlay.remove(path)
+        session.log(f"Dry run: would delete {path}")
+        return
     deleter = os.remove
     mpath = _mark(path)
     if os.path.islink(path):
-        log(f"Deleting link {mpath}")
+        session.log(f"Deleting link {mpath}")
     elif os.path.isfile(path):
-        log(f"Deleting file {mpath}")
+        session.log(f"Deleting file {mpath}")
     elif os.path.isdir(path):
-        log(f"Deleting dir {mpath}")
+        session.log(f"Deleting dir {mpath}")
         # As of python 3.9.5 (and before), shutil.py explicitly punts
         # on MacOS metadata, so the deleter fails on fairly simple
         # MacOS trees stored on NFS.
@@ -351,8 +307,12 @@ def remove(path):
     else:
         import pdb
         pdb.set_trace()
-        ui(f"Don't know how to delete {mpath}!")
+        session.ui(f"Don't know how to delete {mpath}!")
         sys.exit(1)
+    if session.scheduler is not None or session.budget_bytes is not None:
+        session.count("bytes_freed", release(session, path))
+    if session.trash and trash(session, path):
+        return
     try:
         # Two known ways this can fail.
         deleter(path)
@@ -365,65 +325,76 @@ def remove(path):
                 # TODO:  Call chflags(2) directly
                 run(["chflags", "-R", "nouchg", path])
                 deleter(path)
-                ui(f"Deleted {path} after removing nouchg.")
+                session.ui(f"Deleted {path} after removing nouchg.")
             except PermissionError as fuu:
-                ui(f"Couldn't delete {mpath}: {e} and {fuu}")
+                session.ui(f"Couldn't delete {mpath}: {e} and {fuu}")
     except FileNotFoundError as e:
         # 2. Metadata file gets deleted during the operation, confusing rmtree()
-        ui(f"Glitch deleting {filestr(path)}: {e}")
+        session.ui(f"Glitch deleting {filestr(path)}: {e}")
         # import pdb; pdb.set_trace()
 
     # os.path.exists reports false for broken symlinks
     if os.path.exists(path) or os.path.islink(path):
-        ui(f"{RED}Delete of {WHT}\"{path}\"{NORMAL} {RED}failed.{NORMAL}")
+        session.ui(f"{RED}Delete of {WHT}\"{path}\"{NORMAL} {RED}failed.{NORMAL}")
         # import pdb; pdb.set_trace()
-        unstick(path)
+        unstick(session, path)
         try:
             deleter(path)
         except Exception as fuu:
-            ui(f"Even after all that, {WHT}\"{path}\"{NORMAL} isn't deleteable:"
-               f"{RED}{fuu}{NORMAL}")
+            session.ui(f"Even after all that, {WHT}\"{path}\"{NORMAL} isn't deleteable:"
+                       f"{RED}{fuu}{NORMAL}")
             sys.exit(1)
     else:
         pass
         # ui(f"Deleted {WHT}{os.path.basename(path)}{NORMAL}.")
 
 
-def move(src, dest):
+def move(session, src, dest):
     # ui(f"{DIM}Moving {WHT}{_mark(src)}{NORMAL}{DIM} to {dest_abbrev}{NORMAL}")
 
     def trymove(s, d):
         try:
-            shutil.move(s, d)
+            # Across devices, move copies; keep sparse files' holes
+            shutil.move(s, d, copy_function=sparse_copy2)
         except FileExistsError as e:
             # ui(f"Uh. . . .  {e}, {dir(e)}")
             # ui(f"Errno: {e.errno}, filename: {e.filename} args: {e.args}")
             if os.path.islink(d) and not os.path.exists(d):
-                ui(f"Destination {_mark(dest)} is a broken symlink.  "
-                   f"{RED}Skipping{NORMAL}.")
+                session.ui(f"Destination {_mark(dest)} is a broken symlink.  "
+                           f"{RED}Skipping{NORMAL}.")
             else:
                 raise (e)
 
-    log(f"Moving {WHT}{_mark(src)}{NORMAL} to {dest}")
+    if session.overlay is not None:
+        real = session.overlay.resolve(src)
+        session.count("moved")
+        session.count("bytes_moved", release(session, real) if real else 0)
+        session.overlay.move(src, dest)
+        session.log(f"Dry run: would move {src} to {dest}")
+        return
+    session.log(f"Moving {WHT}{_mark(src)}{NORMAL} to {dest}")
+    if session.scheduler is not None:
+        release(session, src)
     try:
         trymove(src, dest)
     except PermissionError as e:
-        ui(f"{YEL}Move Permission Error.{NORMAL}{e}")
-        if unstick(src):
-            ui(f"File {src} seems better.  Retrying once.")
+        session.ui(f"{YEL}Move Permission Error.{NORMAL}{e}")
+        if unstick(session, src):
+            session.ui(f"File {src} seems better.  Retrying once.")
             try:
                 trymove(src, dest)
             except Exception as e:
-                ui(f"Nope.  {RED}{e}{NORMAL}")
-                ui("It could possibly still work to re-run.")
+                session.ui(f"Nope.  {RED}{e}{NORMAL}")
+                session.ui("It could possibly still work to re-run.")
                 sys.exit(1)
-            ui(f"It {src} worked!")
+            session.ui(f"It {src} worked!")
             return
     except FileNotFoundError:
-        ui(f"{YEL}{src}{NORMAL} not found by trymove(), which is weird because os.walk() saw it.")
+        session.ui(f"{YEL}{src}{NORMAL} not found by trymove(), "
+                   "which is weird because os.walk() saw it.")
         pass
     except Exception as e:
-        ui(f"{RED}An unusual error happened:  {e}")
+        session.ui(f"{RED}An unusual error happened:  {e}")
         raise (e)
 
 
@@ -431,7 +402,7 @@ def finderopen(path):
     run(["open", "-R", path])
 
 
-def is_empty(path):
+def is_empty(session, path):
     """Return true for zero length files and empty directories."""
 
     if os.path.isfile(path):
@@ -439,37 +410,58 @@ def is_empty(path):
             return True
     if os.path.isdir(path):
         try:
-            files = os.listdir(path)
+            if not has_entries(path, session.overlay):
+                return True
         except PermissionError as e:
-            ui(f"Can't list dir {WHT}{path}{NORMAL}: {YEL}{e}{NORMAL}")
-            unstick(path)
+            session.ui(f"Can't list dir {WHT}{path}{NORMAL}: {YEL}{e}{NORMAL}")
+            unstick(session, path)
             sys.exit(1)
-        if len(files) == 0:
-            return True
     return False
 
 
-def do_merge(src, dest, level, dry_run_flag, yes_flag):
-    """Top-level call from CLI, set global flags and call initial walk()."""
+def do_merge(src, dest, level, dry_run_flag, yes_flag, session=None):
+    """Top-level call from CLI, set up a MergeSession and call initial walk()."""
 
-    global force_yes
-    global dry_run
-    global dest_dir
-    global dest_abbrev
-    global diff_executable
+    if session is None:
+        session = MergeSession(dest, yes=yes_flag, dry_run=dry_run_flag)
+    session.sources.append(src)
+    walk(session, src, session.dest_dir, level)
+    if session.scheduler is not None:
+        session.scheduler.run()
+    return session
 
-    force_yes = yes_flag
-    dry_run = dry_run_flag
-    dest_dir = dest
-    if dest_dir[-1] != "/":
-        dest_abbrev = dest_dir + "/. . ."
-    else:
-        dest_abbrev = dest_dir + ". . ."
-    walk(src, dest_dir, level)
 
+def walk(session, src_dir, dest_dir, level):
+    """For each file in this directory, dispose of it sensibly (see dispose()).
+
+    With a scheduler, the entries are queued for it instead, to be disposed
+    of largest first."""
+
+    if not has_entries(src_dir, session.overlay):
+        session.ui("Source directory is empty.  ", end='')
+        delete_it = session.answer("Delete it?  [N/y]")
+        if delete_it == "y":
+            remove(session, src_dir)
+        return
+
+    # One pass over both sorted listings tells us which names the destination has
+    for fname, in_src, in_dest in merge_join(src_dir, dest_dir, overlay=session.overlay):
+        if not in_src:
+            continue
+        if fname == TRASH_NAME:
+            # Trashed files stay put, so --undo and --purge can find them
+            session.log(f"Skipped trash directory {os.path.join(src_dir, fname)}")
+            continue
+        if session.over_budget():
+            return
+        if session.scheduler is not None:
+            session.scheduler.push(src_dir, dest_dir, fname, in_dest, level)
+        else:
+            dispose(session, src_dir, dest_dir, fname, in_dest, level)
 
-def walk(src_dir, dest_dir, level):
-    """For each file in this directory, dispose of it sensibly.
+
+def dispose(session, src_dir, dest_dir, fname, in_dest, level):
+    """Dispose of src_dir/fname sensibly.
 
     If it doesn't exist in the destination, offer to move it.
     If it's empty or a symlink, offer to delete it.
@@ -480,167 +472,199 @@ def walk(src_dir, dest_dir, level):
         mode = os.stat(path).st_mode
         return stat.S_ISSOCK(mode)
 
-    fnames = os.listdir(src_dir)
-    if len(fnames) == 0:
-        ui("Source directory is empty.  ", end='')
-        delete_it = answer("Delete it?  [N/y]")
-        if delete_it:
-            remove(src_dir)
+    abs_f = os.path.normpath(os.path.join(src_dir, fname))
+    rule = session.rules.classify(fname)
+    if rule == "prune":
+        session.log(f"Pruned {abs_f}")
+        return
+    if rule == "junk":
+        del_ok = session.answer(f"{abs_f} is junk.  Delete? [Y/n]")
+        if del_ok in ["", "y"]:
+            remove(session, abs_f)
+        return
+    # Checking socketness of abs_f
+    try:
+        if is_socket(abs_f):
+            session.ui(f"{YEL}Skipping socket {filestr(abs_f)}.")
+            return
+    except FileNotFoundError:
+        # This happens if the file is a symlink that points nowhere
+        session.ui(f"Not found file {abs_f} isn't a socket.")
+        basename = os.path.basename(abs_f)
+        if basename[0:1] == "._":
+            session.ui(f"{basename} was metadata file that went away with primary?")
+        else:
+            session.ui(f"{YEL}{basename} is a dead symlink.{NORMAL}  ", end='')
+            delete_it = session.answer("Delete it? [N/y]")
+            if delete_it == "y":
+                remove(session, abs_f)
         return
 
-    for fname in os.listdir(src_dir):
-        abs_f = os.path.normpath(os.path.join(src_dir, fname))
-        # Checking socketness of abs_f
-        try:
-            if is_socket(abs_f):
-                ui(f"{YEL}Skipping socket {filestr(abs_f)}.")
-                continue
-        except FileNotFoundError:
-            # This happens if the file is a symlink that points nowhere
-            ui(f"Not found file {abs_f} isn't a socket.")
-            basename = os.path.basename(abs_f)
-            if basename[0:1] == "._":
-                ui(f"{basename} was metadata file that went away with primary?")
-            else:
-                ui(f"{YEL}{basename} is a dead symlink.{NORMAL}  ", end='')
-                delete_it = answer("Delete it? [N/y]")
-                if delete_it == "y":
-                    remove(abs_f)
-            continue
+    dest_file = os.path.normpath(os.path.join(dest_dir, fname))
+    # Should possibly check socketness of dest_file too, but it hasn't come up.
 
-        dest_file = os.path.normpath(os.path.join(dest_dir, fname))
-        # Should possibly check socketness of dest_file too, but it hasn't come up.
+    # Copies of a git repository can hold the same history in different layouts
+    repo_verdict = compare_repos(session, abs_f, dest_file)
 
-        if not os.path.exists(dest_file):
-            if os.path.islink(dest_file):
-                ui(f"{YEL}Destination {WHT}\"{dest_file}\"{YEL} is a symlink "
-                   "that points nowhere.")
-                del_ok = answer("Delete or skip? [Y/D/s/n]")
-                if del_ok in ["", "y", "d"]:
-                    remove(dest_file)
-                    continue
-            printfiles(abs_f, dest_abbrev, WHT, DIM)
-            safe_move = answer("  Safe.  Move? [Y/n]")
-            if safe_move in ["", "y"]:
-                move(abs_f, dest_file)
-                continue
-        elif is_empty(abs_f) or os.path.islink(abs_f):
-            if is_empty(abs_f):
-                reason = "empty"
-            else:
-                reason = "symlink"
-            del_ok = answer(f"{abs_f} is {reason}.  Delete? [Y/D/n]")
+    if not in_dest or not os.path.exists(dest_file):
+        if in_dest and os.path.islink(dest_file):
+            session.ui(f"{YEL}Destination {WHT}\"{dest_file}\"{YEL} is a symlink "
+                       "that points nowhere.")
+            del_ok = session.answer("Delete or skip? [Y/D/s/n]")
             if del_ok in ["", "y", "d"]:
-                remove(abs_f)
-                continue
-        elif is_identical(abs_f, dest_file):
-            printfiles(abs_f, dest_abbrev, WHT, "")
-            ui("\nIdentical.", end="")
-            merge = answer("  Delete? [Y/n]")
-            if merge in ["", "y"]:
-                remove(abs_f)
-                continue
-            else:
-                ui(f"Kept {abs_f}.")
+                remove(session, dest_file)
+                return
+        printfiles(session, abs_f, session.dest_abbrev, WHT, DIM)
+        safe_move = session.answer("  Safe.  Move? [Y/n]")
+        if safe_move in ["", "y"]:
+            move(session, abs_f, dest_file)
+            return
+    elif is_empty(session, abs_f) or os.path.islink(abs_f):
+        if is_empty(session, abs_f):
+            reason = "empty"
         else:
-            printfiles(abs_f, dest_abbrev, WHT, YEL)
-            ui("  Differs.")
-
-            # Check for directories we shouldn't open
-            dirtype = re.match(
-                ".*\\.git$|.*\\.xcodeproj$|.*\\.nib$"
-                "|.*\\.framework$|.*\\.app$|.*\\.bundle$"
-                "|.*\\.plugin$", abs_f)
-            if dirtype:
-                ui(f"Treating {os.path.basename(abs_f)} as a unit")
-
-            # Check mod times
-            try:
-                abs_f_mtime = os.path.getmtime(abs_f)
-            except PermissionError as e:
-                ui(f"Error checking modification times ({e}).  Attempting fix.")
-                unstick(abs_f)
-                abs_f_mtime = os.path.getmtime(abs_f)
-            # TODO: Should probably catch similar problem at the destination.
-            dest_f_mtime = os.path.getmtime(dest_file)
-            ds = dt.fromtimestamp(dest_f_mtime)
-            readable_date = ds.strftime("%Y-%m-%d %H:%M:%S")
-            if abs_f_mtime == dest_f_mtime:
-                ui(f"Both have the same modification time ({readable_date}).")
+            reason = "symlink"
+        del_ok = session.answer(f"{abs_f} is {reason}.  Delete? [Y/D/n]")
+        if del_ok in ["", "y", "d"]:
+            remove(session, abs_f)
+            return
+    elif repo_verdict:
+        printfiles(session, abs_f, session.dest_abbrev, WHT, "")
+        session.ui(f"\n{REPO_VERDICTS[repo_verdict]}", end="")
+        merge = session.answer("  Delete? [Y/n]")
+        if merge in ["", "y"]:
+            remove(session, abs_f)
+            return
+        else:
+            session.ui(f"Kept {abs_f}.")
+    elif is_identical(session, abs_f, dest_file):
+        printfiles(session, abs_f, session.dest_abbrev, WHT, "")
+        session.ui("\nIdentical.", end="")
+        merge = session.answer("  Delete? [Y/n]")
+        if merge in ["", "y"]:
+            remove(session, abs_f)
+            return
+        else:
+            session.ui(f"Kept {abs_f}.")
+    else:
+        printfiles(session, abs_f, session.dest_abbrev, WHT, YEL)
+        session.ui("  Differs.")
+
+        # Check for directories we shouldn't open
+        dirtype = re.match(
+            ".*\\.git$|.*\\.xcodeproj$|.*\\.nib$"
+            "|.*\\.framework$|.*\\.app$|.*\\.bundle$"
+            "|.*\\.plugin$", abs_f)
+        if dirtype:
+            session.ui(f"Treating {os.path.basename(abs_f)} as a unit")
+
+        # Check mod times
+        try:
+            abs_f_mtime = os.path.getmtime(abs_f)
+        except PermissionError as e:
+            session.ui(f"Error checking modification times ({e}).  Attempting fix.")
+            unstick(session, abs_f)
+            abs_f_mtime = os.path.getmtime(abs_f)
+        # TODO: Should probably catch similar problem at the destination.
+        dest_f_mtime = os.path.getmtime(dest_file)
+        ds = dt.fromtimestamp(dest_f_mtime)
+        readable_date = ds.strftime("%Y-%m-%d %H:%M:%S")
+        if abs_f_mtime == dest_f_mtime:
+            session.ui(f"Both have the same modification time ({readable_date}).")
+        else:
+            diff = abs(abs_f_mtime - dest_f_mtime)
+            amount = nice_delta(diff)
+            if abs_f_mtime > dest_f_mtime:
+                op = "newer"
+            else:
+                op = "older"
+                session.ui(f"{WHT}{_mark(abs_f)}{NORMAL} is {amount} {op} than "
+                           f"{YEL}{session.dest_abbrev}{NORMAL} ({readable_date}).")
+
+        # Report size
+        if os.path.isfile(abs_f):
+            asize = os.path.getsize(abs_f)
+            dsize = os.path.getsize(dest_file)
+            if asize == dsize:
+                session.ui(f"Both are {nice_size(asize)}.")
+            else:
+                session.ui(f"{WHT}{abs_f}{NORMAL} is {nice_size(asize)}, "
+                           f"{YEL}{session.dest_abbrev}{NORMAL} is {nice_size(dsize)}.")
+
+        # If this is a flatfile or monolithic directory, offer to delete older
+        if os.path.isfile(abs_f) or dirtype:
+            if abs_f_mtime > dest_f_mtime:
+                older_file = dest_file
             else:
-                diff = abs(abs_f_mtime - dest_f_mtime)
-                amount = nice_delta(diff)
-                if abs_f_mtime > dest_f_mtime:
-                    op = "newer"
-                else:
-                    op = "older"
-                    ui(f"{WHT}{_mark(abs_f)}{NORMAL} is {amount} {op} than "
-                       f"{YEL}{dest_abbrev}{NORMAL} ({readable_date}).")
-
-            # Report size
-            if os.path.isfile(abs_f):
-                asize = os.path.getsize(abs_f)
-                dsize = os.path.getsize(dest_file)
-                if asize == dsize:
-                    ui(f"Both are {nice_size(asize)}.")
-                else:
-                    ui(f"{WHT}{abs_f}{NORMAL} is {nice_size(asize)}, "
-                       f"{YEL}{dest_abbrev}{NORMAL} is {nice_size(dsize)}.")
-
-            # If this is a flatfile or monolithic directory, offer to delete older
-            if os.path.isfile(abs_f) or dirtype:
-                if abs_f_mtime > dest_f_mtime:
-                    older_file = dest_file
-                else:
-                    older_file = abs_f
-                del_ok = "d"
-                while del_ok == 'd':
-                    del_ok = answer(f"[R]emove older file ({older_file + _dmark(older_file)}) "
-                                    "or show [d]iff [R/n/d]?")
-                    if del_ok == 'd':
-                        ui("\n{BOLD}Showing Diff{NORMAL}")
-                        rv = run([DIFF, "-r", abs_f, dest_file], capture_output=True)
-                        ui(rv.stdout)
-                    if del_ok in ['', 'r', 'y']:
-                        remove(older_file)
-                        continue
-                    if del_ok == 'n':
-                        pass
-                continue
+                older_file = abs_f
+            del_ok = "d"
+            while del_ok == 'd':
+                del_ok = session.answer(
+                    f"[R]emove older file ({older_file + _dmark(older_file)}) "
+                    "or show [d]iff [R/n/d]?")
+                if del_ok == 'd':
+                    session.ui("\n{BOLD}Showing Diff{NORMAL}")
+                    rv = run([session.diff, "-r", abs_f, dest_file], capture_output=True)
+                    session.ui(rv.stdout)
+                if del_ok in ['', 'r', 'y']:
+                    remove(session, older_file)
+                    continue
+                if del_ok == 'n':
+                    pass
+            return
+        if os.path.isdir(abs_f):
+            abs_f_entries = safe_len(session, abs_f)
+            # Weird case: Source dir, dest file
+            if not os.path.isdir(dest_file):
+                session.ui(f"{WHT}{abs_f}{NORMAL} is a dir with {abs_f_entries} files, "
+                           f"{session.dest_abbrev} is a plain file.  Not sure what to do.")
+                sys.exit()
+            dest_entries = safe_len(session, dest_file)
+            session.ui(f"{WHT}{abs_f}{NORMAL} has {abs_f_entries} files, "
+                       f"{session.dest_abbrev} has {dest_entries}.")
+
+            # Ask for help
             if os.path.isdir(abs_f):
-                abs_f_entries = len(os.listdir(abs_f))
-                # Weird case: Source dir, dest file
-                if not os.path.isdir(dest_file):
-                    ui(f"{WHT}{abs_f}{NORMAL} is a dir with {abs_f_entries} files, "
-                       f"{dest_abbrev} is a plain file.  Not sure what to do.")
-                    sys.exit()
-                dest_entries = len(os.listdir(dest_file))
-                ui(f"{WHT}{abs_f}{NORMAL} has {abs_f_entries} files, "
-                   f"{dest_abbrev} has {dest_entries}.")
-
-                # Ask for help
-                if os.path.isdir(abs_f):
-                    action = answer("[C]heck inside, [o]pen in finder, or [s]kip [Cos]?")
-                    if action in ["y", "c", ""]:
-                        walk(abs_f, dest_file, level + 1)
-                    elif action == "o":
-                        finderopen(abs_f)
-                        finderopen(dest_file)
-                    elif action == "s":
-                        ui("Skipping.")
-
-
-def move_maybe(src, dst, yes_flag=False, dry_run_flag=False):
+                action = session.answer("[C]heck inside, [o]pen in finder, or [s]kip [Cos]?")
+                if action in ["y", "c", ""]:
+                    walk(session, abs_f, dest_file, level + 1)
+                    if session.scheduler is None:
+                        offer_empty(session, abs_f)
+                elif action == "o":
+                    finderopen(abs_f)
+                    finderopen(dest_file)
+                elif action == "s":
+                    session.ui("Skipping.")
+
+
+def offer_empty(session, path):
+    """Offer to delete directory path if merging its contents has emptied it.
+
+    Saves a whole extra run per level of the tree.  Returns True if path
+    was deleted.
+    """
+    if session.lexists(path) and not has_entries(path, session.overlay):
+        del_ok = session.answer(f"{path} is empty now.  Delete? [Y/D/n]")
+        if del_ok in ["", "y", "d"]:
+            remove(session, path)
+            return True
+    return False
+
+
+def move_maybe(src, dst, yes_flag=False, dry_run_flag=False, session=None):
     """If src and dst both exist and have the same content, delete src.
     If they differ, offer to move src to dst's enclosing directory (if
     it exists) with a unique name."""
-    ui(f"Maybe moving {src} to {dst}")
+    if session is None:
+        session = MergeSession(os.path.dirname(dst) or ".", yes=yes_flag, dry_run=dry_run_flag)
+    session.ui(f"Maybe moving {src} to {dst}")
     assert os.path.isfile(src)
     if not os.path.exists(dst):
-        move(src, dst)
+        move(session, src, dst)
     elif os.path.isfile(dst):
-        if is_identical(src, dst):
-            ui(f"{filestr(src)} and {filestr(dst)} are identical.  Deleting {filestr(src)}.")
-            remove(src)
+        if is_identical(session, src, dst):
+            session.ui(f"{filestr(src)} and {filestr(dst)} are identical.  "
+                       f"Deleting {filestr(src)}.")
+            remove(session, src)
     else:
-        ui(f"{filestr(src)} and {filestr(dst)} differ or something.  Ignoring for now.")
+        session.ui(f"{filestr(src)} and {filestr(dst)} differ or something.  Ignoring for now.")
@@ -80,9 +80,9 @@ GB = 1024 * MB
 def nice_size(bytes):
     """Report bytes in appropriate units for size: T, G, M, K."""
     if bytes > GB:
-        return f"{int(bytes*GB/10)/10} GB"
+        return f"{int(bytes*10/GB)/10} GB"
     if bytes > MB:
-        return f"{int(bytes*MB/10)/10} MB"
+        return f"{int(bytes*10/MB)/10} MB"
     if bytes > KB:
         return f"{int(bytes*10/KB)/10} KB"
     return f"{bytes}B"
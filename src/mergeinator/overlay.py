@@ -0,0 +1,77 @@
+"""An in-memory overlay of planned moves and deletes, for --dryrun.
+
+A dry run that just answers "no" can't show what happens after the
+first level: directories only become empty (and deletable) once their
+contents have been merged.  Instead, a dry run applies each move and
+delete to an Overlay, and the walk lists directories through it, so a
+single read-only pass shows the whole multi-level outcome.
+
+Paths that were moved keep their content at the real source path;
+resolve() maps an overlay path back to it.  Comparisons read the real
+files, which is safe because nothing a pass compares has been changed
+earlier in that pass.
+"""
+
+import os
+from threading import Lock
+
+
+class Overlay:
+    """Planned changes on top of the real filesystem."""
+
+    def __init__(self):
+        self._lock = Lock()
+        # Key paths are absolute.  deleted and added hold whole subtrees.
+        self._deleted = set()
+        self._added = {}
+        # Per-directory changes to listings: {dir: set(names)}
+        self._hidden = {}
+        self._extra = {}
+
+    def resolve(self, path):
+        """Return the real path holding path's content, or None if it's been deleted."""
+        path = os.path.abspath(path)
+        with self._lock:
+            probe = path
+            while True:
+                if probe in self._added:
+                    return self._added[probe] + path[len(probe):]
+                if probe in self._deleted:
+                    return None
+                parent = os.path.dirname(probe)
+                if parent == probe:
+                    return path
+                probe = parent
+
+    def lexists(self, path):
+        real = self.resolve(path)
+        return real is not None and os.path.lexists(real)
+
+    def changes(self, dir_path):
+        """Return (names hidden from, names added to) the listing of dir_path."""
+        dir_path = os.path.abspath(dir_path)
+        with self._lock:
+            return set(self._hidden.get(dir_path, ())), sorted(self._extra.get(dir_path, ()))
+
+    def _unlink(self, path):
+        parent, name = os.path.split(path)
+        self._extra.get(parent, set()).discard(name)
+        self._hidden.setdefault(parent, set()).add(name)
+        self._added.pop(path, None)
+        self._deleted.add(path)
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._unlink(path)
+
+    def move(self, src, dest):
+        real = self.resolve(src)
+        src, dest = os.path.abspath(src), os.path.abspath(dest)
+        with self._lock:
+            self._unlink(src)
+            parent, name = os.path.split(dest)
+            self._hidden.get(parent, set()).discard(name)
+            self._extra.setdefault(parent, set()).add(name)
+            self._deleted.discard(dest)
+            self._added[dest] = real
@@ -0,0 +1,68 @@
+"""Ignore rules: names to leave alone ("prune") or delete unexamined ("junk").
+
+Rules are shell globs matched against an entry's name (not its whole
+path).  All the globs are compiled into one regular expression, so
+classifying a name costs a single match no matter how many rules there
+are.
+
+A rules file has one rule per line:
+
+    # Don't descend into these, or compare them
+    prune: node_modules
+    prune: .cache
+    # Delete these without comparing
+    junk: .DS_Store
+    junk: ._*
+
+A line without a "prune:" or "junk:" prefix is a prune rule.
+"""
+
+import re
+from fnmatch import translate
+
+ACTIONS = ["prune", "junk"]
+
+
+class Rules:
+    """A compiled set of prune and junk globs."""
+
+    def __init__(self, prune=(), junk=()):
+        self.patterns = {"prune": list(prune), "junk": list(junk)}
+        groups = []
+        # Earlier groups win, so a name that's both pruned and junk is pruned
+        for action in ACTIONS:
+            if self.patterns[action]:
+                alternatives = "|".join(translate(glob) for glob in self.patterns[action])
+                groups.append(f"(?P<{action}>{alternatives})")
+        self._matcher = re.compile("|".join(groups)) if groups else None
+
+    @classmethod
+    def from_file(cls, path, prune=(), junk=()):
+        """Read rules from path, adding them to the prune and junk globs given."""
+        patterns = {"prune": list(prune), "junk": list(junk)}
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                action, sep, glob = line.partition(":")
+                if sep and action.strip() in ACTIONS:
+                    patterns[action.strip()].append(glob.strip())
+                else:
+                    patterns["prune"].append(line)
+        return cls(**patterns)
+
+    def __bool__(self):
+        return self._matcher is not None
+
+    def classify(self, name):
+        """Return "prune", "junk", or None for a file or directory name."""
+        if self._matcher is None:
+            return None
+        m = self._matcher.match(name)
+        if m is None:
+            return None
+        groups = m.groupdict()
+        for action in ACTIONS:
+            if groups.get(action) is not None:
+                return action
@@ -0,0 +1,161 @@
+"""Space-first scheduling: dispose of the biggest reclaimable entries first.
+
+Normally walk() handles entries in listing order, depth first, so a run
+that's interrupted (or has a --budget) may have spent its time on tiny
+directories.  With a Scheduler, walk() queues entries instead, and the
+scheduler disposes of them in order of estimated reclaimable bytes.
+The queue is global: when a directory is opened up, its entries join
+the same queue as everything else, at every level.
+
+The estimate comes from a cheap metadata pre-scan (the allocated size
+of each source subtree, computed once and memoized):
+
+  * in both source and destination: the source's size (deleting a
+    duplicate frees all of it);
+  * only in the source: nothing if the move is a rename on the same
+    filesystem, otherwise its size;
+  * junk: its size.
+"""
+
+import heapq
+import os
+import re
+import stat
+
+TIME_UNITS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hr": 3600, "d": 86400}
+BYTE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+
+def parse_budget(text):
+    """Parse a --budget like "90m", "2h", or "50GB" into (seconds, bytes).
+
+    One of the two is None.  Units ending in "B" (or a bare K/M/G/T) are
+    bytes; s, m, min, h, and d are time.
+    """
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*", text)
+    if m is None:
+        raise ValueError(f"Can't understand budget {text!r}")
+    amount, unit = float(m.group(1)), m.group(2)
+    if unit in ["K", "M", "G", "T"] or unit.lower().endswith("b"):
+        prefix = unit.lower().rstrip("b").rstrip("i")
+        if prefix in BYTE_UNITS:
+            return None, int(amount * BYTE_UNITS[prefix])
+    elif unit.lower() in TIME_UNITS:
+        return amount * TIME_UNITS[unit.lower()], None
+    raise ValueError(f"Unknown budget unit {unit!r} in {text!r}")
+
+
+def _allocated(st):
+    return st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+
+
+def tree_size(session, path):
+    """Return the bytes allocated to path and everything under it.
+
+    Directory sizes are memoized in the session, so the pre-scan of a
+    tree is done once, however many levels ask about it.
+    """
+    path = os.path.normpath(path)
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return _allocated(st)
+    # An explicit stack, since trees can be deeper than Python's recursion
+    # limit.  A directory is pushed again with its subdirectories and the
+    # total of its other entries, and its size recorded once theirs are.
+    stack = [(path, None, 0)]
+    while stack:
+        dir_path, subdirs, files = stack.pop()
+        if subdirs is not None:
+            with session.lock:
+                session.sizes[dir_path] = files + sum(session.sizes.get(d, 0) for d in subdirs)
+            continue
+        with session.lock:
+            if dir_path in session.sizes:
+                continue
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        subdirs.append(entry.path)
+                    else:
+                        files += _allocated(st)
+        except OSError:
+            pass
+        stack.append((dir_path, subdirs, files))
+        stack.extend((d, None, 0) for d in subdirs)
+    with session.lock:
+        return session.sizes.get(path, 0)
+
+
+def release(session, path):
+    """Return path's size, and take it out of the memoized sizes above it.
+
+    Call this before path is removed or moved away.
+    """
+    path = os.path.normpath(path)
+    size = tree_size(session, path)
+    with session.lock:
+        session.sizes.pop(path, None)
+        parent = os.path.dirname(path)
+        while parent in session.sizes:
+            session.sizes[parent] -= size
+            parent = os.path.dirname(parent)
+    return size
+
+
+class Scheduler:
+    """A global queue of source entries, biggest reclaimable first."""
+
+    def __init__(self, session):
+        self.session = session
+        self._heap = []
+        self._seq = 0
+
+    def estimate(self, src_dir, dest_dir, fname, in_dest):
+        """Estimate the bytes disposing of src_dir/fname would free."""
+        session = self.session
+        path = os.path.join(src_dir, fname)
+        if in_dest or session.rules.classify(fname) == "junk":
+            return tree_size(session, path)
+        same_fs = session.cached(("dev", src_dir), lambda: os.lstat(src_dir).st_dev) == \
+            session.cached(("dev", dest_dir), lambda: os.lstat(dest_dir).st_dev)
+        return 0 if same_fs else tree_size(session, path)
+
+    def push(self, src_dir, dest_dir, fname, in_dest, level):
+        if self.session.rules.classify(fname) == "prune":
+            self.session.log(f"Pruned {os.path.join(src_dir, fname)}")
+            return
+        size = self.estimate(src_dir, dest_dir, fname, in_dest)
+        with self.session.lock:
+            # seq keeps equal sizes in listing order, and tuples comparable
+            self._seq += 1
+            heapq.heappush(self._heap, (-size, self._seq, src_dir, dest_dir, fname, level))
+
+    def run(self):
+        """Dispose of queued entries, biggest first, until done or over budget."""
+        from .mergeinator import dispose, offer_empty
+
+        session = self.session
+        while self._heap:
+            if session.over_budget():
+                session.ui(f"Budget used up with {len(self._heap)} entries left.")
+                return
+            with session.lock:
+                _, _, src_dir, dest_dir, fname, level = heapq.heappop(self._heap)
+            # Things may have changed since this was queued
+            if not session.lexists(os.path.join(src_dir, fname)):
+                continue
+            in_dest = session.lexists(os.path.join(dest_dir, fname))
+            dispose(session, src_dir, dest_dir, fname, in_dest, level)
+            # Deleting an emptied directory may empty its parent, up to the top
+            while level > 0 and offer_empty(session, src_dir):
+                src_dir = os.path.dirname(src_dir)
+                level -= 1
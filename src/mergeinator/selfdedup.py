@@ -0,0 +1,280 @@
+"""Duplicates within a single tree: merge --self.
+
+walk() only pairs entries with the same name in the same place in the
+source and the destination, so copies of a project or a photo import at
+different paths in one tree never meet.  An Index finds them in four
+passes, keeping everything in an on-disk sqlite3 database so memory
+stays small however many files there are:
+
+  1. scan: record each entry's path, parent, kind, and size;
+  2. partial digest: hash the first PARTIAL_SIZE bytes of each file
+     whose size isn't unique;
+  3. full digest: hash all of each file whose size and partial digest
+     both match another file's;
+  4. directory digests, deepest first: a Merkle hash of each child's
+     name, kind, and digest.  A file that never got a full digest is
+     unique, so it gets a unique token, and its directories are unique
+     too.
+
+Duplicates are reported at the highest level where they match: when two
+directories are copies, the files inside them aren't listed again.
+Empty files and directories (those with no non-empty files) are ignored,
+and so is the trash: what's in it is on its way out, so it's never the
+copy that's kept.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+from .compare import _Reader, block_size, compare_paths
+from .logs import NORMAL, WHT, YEL
+from .mergeinator import not_dead_gen, offer_empty, remove
+from .nicer import nice_size
+from .trash import TRASH_NAME
+
+PARTIAL_SIZE = 64 * 1024
+BATCH = 10_000
+
+SCHEMA = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    name BLOB,
+    path BLOB,
+    kind TEXT,
+    size INTEGER,
+    depth INTEGER,
+    inode TEXT
+);
+CREATE TABLE partials (id INTEGER PRIMARY KEY, size INTEGER, partial BLOB);
+-- size is the subtree's total for directories; nfiles counts non-empty files
+CREATE TABLE digests (id INTEGER PRIMARY KEY, digest BLOB, size INTEGER, nfiles INTEGER);
+"""
+
+
+def _hash(data=b"", tag=b"file"):
+    # The tag keeps a file's digest from ever matching a directory's
+    return hashlib.blake2b(data, digest_size=20, person=tag)
+
+
+class Index:
+    """A content index of one directory tree."""
+
+    def __init__(self, session, db_path):
+        self.session = session
+        self.db = sqlite3.connect(db_path)
+        # It's a scratch database: don't pay for durability
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.executescript(SCHEMA)
+        self._tick = not_dead_gen(session)
+        self._unreadable = set()
+
+    def close(self):
+        self.db.close()
+
+    def build(self, root):
+        self.scan(root)
+        self.db.execute("CREATE INDEX by_parent ON entries (parent)")
+        self.hash_files()
+        self.hash_dirs()
+        self.db.execute("CREATE INDEX by_digest ON digests (digest)")
+        self.db.commit()
+
+    def scan(self, root):
+        """Pass 1: record every entry under root, except the trash and those matching the rules."""
+        session = self.session
+        entries, digests = [], []
+        next_id = 1
+        entries.append((next_id, None, b"", os.fsencode(root), "dir", 0, 0, None))
+        stack = [(next_id, root, 0)]
+        while stack:
+            dir_id, path, depth = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.name == TRASH_NAME or session.rules.classify(entry.name):
+                            continue
+                        next_id += 1
+                        st = entry.stat(follow_symlinks=False)
+                        inode = None
+                        if entry.is_dir(follow_symlinks=False):
+                            kind = "dir"
+                            stack.append((next_id, entry.path, depth + 1))
+                        elif entry.is_symlink():
+                            kind = "link"
+                            target = os.fsencode(os.readlink(entry.path))
+                            digests.append((next_id, _hash(target, b"link").digest(), 0, 0))
+                        elif entry.is_file(follow_symlinks=False):
+                            kind = "file"
+                            inode = f"{st.st_dev}:{st.st_ino}"
+                            if st.st_size == 0:
+                                digests.append((next_id, _hash().digest(), 0, 0))
+                        else:
+                            # Like compare_paths(), special files only compare by type
+                            kind = "other"
+                            digests.append((next_id, _hash(tag=b"other").digest(), 0, 0))
+                        entries.append((next_id, dir_id, os.fsencode(entry.name),
+                                        os.fsencode(entry.path), kind,
+                                        st.st_size if kind == "file" else 0, depth + 1, inode))
+                        if len(entries) >= BATCH:
+                            self._insert(entries, digests)
+            except OSError as e:
+                session.ui(f"{YEL}Can't read {path} ({e}), so it's treated as unique.{NORMAL}")
+                self._unreadable.add(dir_id)
+        self._insert(entries, digests)
+
+    def _insert(self, entries, digests):
+        self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+        self.db.executemany("INSERT INTO digests VALUES (?, ?, ?, ?)", digests)
+        entries.clear()
+        digests.clear()
+        next(self._tick)
+
+    def _digest(self, path, limit=None):
+        """Return the digest of path's first limit bytes (or all of it), or None."""
+        session = self.session
+        try:
+            st = os.stat(path)
+            size = block_size(session, st)
+            end = st.st_size if limit is None else min(limit, st.st_size)
+            h = _hash()
+            reader = _Reader(path)
+            try:
+                offset = 0
+                while offset < end:
+                    data = reader.pread(offset, min(size, end - offset))
+                    if not data:
+                        break
+                    session.count("bytes_read", len(data))
+                    h.update(data)
+                    offset += len(data)
+            finally:
+                reader.close()
+        except OSError as e:
+            session.log(f"Can't read {path} ({e}), so it's treated as unique.")
+            return None
+        next(self._tick)
+        return h.digest()
+
+    def hash_files(self):
+        """Passes 2 and 3: partial, then full digests, only where sizes collide."""
+        rows = []
+        for id, path, size in self.db.execute(
+                "SELECT id, path, size FROM entries"
+                " WHERE kind = 'file' AND size > 0 AND size IN (SELECT size FROM entries"
+                "   WHERE kind = 'file' GROUP BY size HAVING COUNT(*) > 1)"):
+            partial = self._digest(os.fsdecode(path), PARTIAL_SIZE)
+            if partial is not None:
+                rows.append((id, size, partial))
+            if len(rows) >= BATCH:
+                self.db.executemany("INSERT INTO partials VALUES (?, ?, ?)", rows)
+                rows.clear()
+        self.db.executemany("INSERT INTO partials VALUES (?, ?, ?)", rows)
+        rows.clear()
+
+        for id, path, size, partial in self.db.execute(
+                "SELECT p.id, e.path, p.size, p.partial FROM partials p"
+                " JOIN entries e ON e.id = p.id"
+                " JOIN (SELECT size, partial FROM partials GROUP BY size, partial"
+                "       HAVING COUNT(*) > 1) g ON g.size = p.size AND g.partial = p.partial"):
+            # A small file's partial digest already covers all of it
+            digest = partial if size <= PARTIAL_SIZE else self._digest(os.fsdecode(path))
+            if digest is not None:
+                rows.append((id, digest, size, 1))
+            if len(rows) >= BATCH:
+                self.db.executemany("INSERT INTO digests VALUES (?, ?, ?, ?)", rows)
+                rows.clear()
+        self.db.executemany("INSERT INTO digests VALUES (?, ?, ?, ?)", rows)
+
+    def hash_dirs(self):
+        """Pass 4: Merkle digests of directories, children before parents."""
+        for (dir_id, ) in self.db.execute(
+                "SELECT id FROM entries WHERE kind = 'dir' ORDER BY depth DESC"):
+            h = _hash(tag=b"dir")
+            size = nfiles = 0
+            for id, name, kind, file_size, digest, sub_size, sub_nfiles in self.db.execute(
+                    "SELECT e.id, e.name, e.kind, e.size, d.digest, d.size, d.nfiles"
+                    " FROM entries e LEFT JOIN digests d ON d.id = e.id"
+                    " WHERE e.parent = ? ORDER BY e.name", (dir_id, )):
+                if digest is None:
+                    # Nothing else has this file's size and partial digest
+                    digest = f"unique {id}".encode()
+                if kind == "dir":
+                    size += sub_size
+                    nfiles += sub_nfiles
+                elif kind == "file":
+                    size += file_size
+                    nfiles += file_size > 0
+                h.update(b"%s\0%s\0%s\0" % (name, kind.encode(), digest))
+            digest = h.digest()
+            if dir_id in self._unreadable:
+                digest = f"unique {dir_id}".encode()
+            self.db.execute("INSERT INTO digests VALUES (?, ?, ?, ?)",
+                            (dir_id, digest, size, nfiles))
+
+    def duplicates(self):
+        """Yield (kind, size, members) for each set of duplicates, most space first.
+
+        members is [(path, inode, covered), ...], covered ones first.  An
+        entry is covered if its directory is itself a duplicate, so it's
+        dealt with at that higher level.
+        """
+        groups = self.db.execute(
+            "SELECT e.kind, d.digest, MAX(d.size), COUNT(*) AS n"
+            " FROM digests d JOIN entries e ON e.id = d.id"
+            " WHERE e.kind IN ('dir', 'file') AND d.nfiles > 0"
+            " GROUP BY e.kind, d.digest HAVING n > 1 ORDER BY MAX(d.size) * (n - 1) DESC")
+        for kind, digest, size, _ in groups:
+            members = self.db.execute(
+                "SELECT e.path, e.inode, EXISTS (SELECT 1 FROM digests pd"
+                "   JOIN digests ps ON ps.digest = pd.digest AND ps.id != pd.id"
+                "   WHERE pd.id = e.parent) AS covered"
+                " FROM digests d JOIN entries e ON e.id = d.id"
+                " WHERE d.digest = ? AND e.kind = ? ORDER BY covered DESC, e.path",
+                (digest, kind)).fetchall()
+            yield kind, size, [(os.fsdecode(path), inode, covered)
+                               for path, inode, covered in members]
+
+
+def dedup(session, root):
+    """Find duplicate files and directories under root, and offer to delete the extras."""
+    with tempfile.TemporaryDirectory(prefix="merge-self-") as tmp:
+        index = Index(session, os.path.join(tmp, "index.db"))
+        try:
+            session.ui(f"Indexing {WHT}{root}{NORMAL}...")
+            index.build(root)
+            found = 0
+            for kind, size, members in index.duplicates():
+                if session.over_budget():
+                    break
+                # If root is inside a trash, its copies are on their way out: leave them be
+                existing = [m for m in members if session.lexists(m[0])
+                            and TRASH_NAME not in os.path.abspath(m[0]).split(os.sep)]
+                if len(existing) < 2:
+                    continue
+                keep, keep_inode, _ = existing[0]
+                # Hard links to the kept file share its space, so aren't extras
+                extras = [path for path, inode, covered in existing[1:]
+                          if not covered and (inode is None or inode != keep_inode)]
+                if not extras:
+                    continue
+                found += 1
+                session.ui(f"{WHT}{keep}{NORMAL} ({kind}, {nice_size(size)}) "
+                           f"has {len(extras)} duplicate{'s' if len(extras) > 1 else ''}:")
+                for path in extras:
+                    session.ui(f"  {YEL}{path}{NORMAL}", end="")
+                    if session.answer("  Delete? [Y/n]") not in ["", "y"]:
+                        continue
+                    # It's been a while since these were read
+                    if compare_paths(session, path, keep):
+                        remove(session, path)
+                        offer_empty(session, os.path.dirname(path))
+                    else:
+                        session.ui(f"{path} has changed since it was indexed.  Keeping it.")
+        finally:
+            index.close()
+    session.ui(f"Found {found} sets of duplicates.")
+    return session
@@ -0,0 +1,190 @@
+"""MergeSession: everything one merge needs, so several can run at once."""
+
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime as dt
+from threading import RLock
+
+from .logs import BLD, GRN, RED, NORMAL, write_log
+from .overlay import Overlay
+from .rules import Rules
+
+
+class MergeSession:
+    """Configuration, caches, and I/O callbacks for one merge.
+
+    Nothing here is shared between sessions, so separate sessions can
+    run in separate threads.  A single session may also be used from
+    several threads: prompts, logging, and the caches are serialized
+    by the session's lock.
+
+    Comparison policy: normally every file pair is compared byte for byte.
+    With trust_metadata, pairs with the same size and mtime are taken as
+    identical, except for a random sample_rate fraction of them which are
+    still read.  If a sampled pair turns out to differ, everything under
+    that comparison is read in full from then on (see escalate()).
+
+    rules (a rules.Rules) names entries to skip entirely or delete
+    without comparing.
+
+    With largest_first, entries are handled biggest reclaimable first
+    across the whole tree (see schedule.py).  The run stops early once
+    budget_seconds have passed or budget_bytes have been freed.
+
+    With dry_run, nothing is changed: questions get their default answer
+    (or "y" with yes), and moves and deletes are applied to an in-memory
+    overlay (see overlay.py) that the rest of the walk sees.
+
+    With trash, deletes are renames into a per-filesystem trash directory
+    (see trash.py), or into trash_dir if given.  The session's trash isn't
+    purged by other sessions until it's closed (see close(), or use it as
+    a context manager) or the process exits.
+
+    Callbacks:
+        ask(question) -> str: get an answer from the user (default input()).
+        echo(*args, **kwargs): show output, called like print().
+        logger(*args, **kwargs): record output, called like print().
+            Defaults to appending to log_path.
+    """
+
+    def __init__(self, dest, yes=False, dry_run=False, ask=input, echo=print, logger=None,
+                 log_path="merge.log", trust_metadata=False, sample_rate=0.05, seed=None,
+                 rules=None, trash=False, trash_dir=None, largest_first=False,
+                 budget_seconds=None, budget_bytes=None):
+        self.force_yes = yes
+        self.dry_run = dry_run
+        self.dest_dir = dest
+        # Directories merged from, so the trash isn't put inside them
+        self.sources = []
+        if dest[-1] != "/":
+            self.dest_abbrev = dest + "/. . ."
+        else:
+            self.dest_abbrev = dest + ". . ."
+        self.ask = ask
+        self.echo = echo
+        self.log_path = log_path
+        self.logger = logger
+        self.lock = RLock()
+        self._cache = {}
+        self._on_close = []
+        self.stats = Counter()
+        self.trust_metadata = trust_metadata
+        self.sample_rate = sample_rate
+        self._rng = random.Random(seed)
+        self._escalated = set()
+        self.rules = rules if rules is not None else Rules()
+        self.trash = trash
+        self.trash_dir = trash_dir
+        self.run_id = f"{dt.now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{id(self):x}"
+        self.sizes = {}
+        self.scheduler = None
+        if largest_first:
+            from .schedule import Scheduler
+            self.scheduler = Scheduler(self)
+        self.budget_seconds = budget_seconds
+        self.budget_bytes = budget_bytes
+        self.start_time = time.monotonic()
+        self.overlay = Overlay() if dry_run else None
+
+    def log(self, *args, **kwargs):
+        if self.logger is not None:
+            self.logger(*args, **kwargs)
+        else:
+            write_log(self.log_path, *args, **kwargs)
+
+    def ui(self, *args, **kwargs):
+        with self.lock:
+            self.echo(*args, **kwargs)
+            self.log(*args, **kwargs)
+
+    def answer(self, question):
+        """Ask question, unless --yes or --dryrun already answered it."""
+        with self.lock:
+            if self.dry_run:
+                # Plan what a real run would do, with the default answer (or --yes)
+                retval = 'y' if self.force_yes else ''
+                self.echo(question, BLD + GRN + (retval or "(default)") + NORMAL)
+            elif self.force_yes:
+                self.echo(question, BLD + RED + "y" + NORMAL)
+                retval = 'y'
+            else:
+                retval = str.lower(self.ask(question))
+            self.log(question, retval)
+        return retval
+
+    def close(self):
+        """Release what the session holds, e.g. the lock on its trash run."""
+        with self.lock:
+            callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback()
+
+    def on_close(self, callback):
+        """Call callback() when the session is closed."""
+        with self.lock:
+            self._on_close.append(callback)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lexists(self, path):
+        """os.path.lexists(), as it would be after a dry run's planned changes."""
+        if self.overlay is not None:
+            return self.overlay.lexists(path)
+        return os.path.lexists(path)
+
+    def cached(self, key, compute):
+        """Return the cached value for key, calling compute() the first time."""
+        with self.lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    def count(self, stat, amount=1):
+        """Add amount to the running total for stat (e.g. "bytes_read")."""
+        with self.lock:
+            self.stats[stat] += amount
+
+    def over_budget(self):
+        """Return True once the time or bytes budget is used up."""
+        if self.budget_seconds is not None and \
+                time.monotonic() - self.start_time >= self.budget_seconds:
+            return True
+        return self.budget_bytes is not None and self.stats["bytes_freed"] >= self.budget_bytes
+
+    def should_sample(self):
+        """Decide whether a metadata-trusted pair gets its content verified anyway."""
+        with self.lock:
+            return self._rng.random() < self.sample_rate
+
+    def escalate(self, path):
+        """Stop trusting metadata for anything under path."""
+        with self.lock:
+            self._escalated.add(os.path.normpath(path))
+
+    def is_escalated(self, path):
+        path = os.path.normpath(path)
+        with self.lock:
+            while True:
+                if path in self._escalated:
+                    return True
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return False
+                path = parent
+
+    @property
+    def diff(self):
+        """Path of the diff executable to use."""
+        from .mergeinator import find_diff
+        return self.cached("diff", find_diff)
+
+    def merge(self, src, level=0):
+        """Merge src into this session's destination."""
+        from .mergeinator import do_merge
+        do_merge(src, self.dest_dir, level, self.dry_run, self.force_yes, session=self)
@@ -0,0 +1,85 @@
+"""Sparse files: find where the data is with SEEK_DATA/SEEK_HOLE.
+
+VM disk images and database files are often mostly holes.  Reading a
+hole just returns zeros, so comparing or copying one should only touch
+the data extents.  Filesystems (or platforms) without SEEK_DATA report
+the whole file as one data extent.
+"""
+
+import errno
+import os
+import shutil
+
+COPY_SIZE = 1024 * 1024
+
+
+def is_sparse(st):
+    """Return True if the file with stat st has fewer blocks than its size needs."""
+    return getattr(st, "st_blocks", None) is not None and st.st_blocks * 512 < st.st_size
+
+
+def data_extents(fd, size):
+    """Return [(start, end), ...] of the data (non-hole) regions of open file fd."""
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)] if size else []
+    extents = []
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Nothing but hole from offset to the end
+                break
+            if e.errno == errno.EINVAL and offset == 0:
+                # Filesystem doesn't support SEEK_DATA
+                return [(0, size)]
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        extents.append((start, end))
+        offset = end
+    os.lseek(fd, 0, os.SEEK_SET)
+    return extents
+
+
+def union_extents(a, b):
+    """Merge two sorted extent lists into the sorted regions covered by either."""
+    merged = []
+    for start, end in sorted(a + b):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def sparse_copy2(src, dst, *, follow_symlinks=True):
+    """shutil.copy2(), except that holes in a sparse src stay holes in dst.
+
+    Suitable as the copy_function for shutil.move() and shutil.copytree().
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    st = os.stat(src, follow_symlinks=follow_symlinks)
+    if (not follow_symlinks and os.path.islink(src)) or not is_sparse(st):
+        return shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+    fd_in = os.open(src, os.O_RDONLY)
+    try:
+        fd_out = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            for start, end in data_extents(fd_in, st.st_size):
+                offset = start
+                while offset < end:
+                    data = os.pread(fd_in, min(COPY_SIZE, end - offset), offset)
+                    if not data:
+                        break
+                    os.pwrite(fd_out, data, offset)
+                    offset += len(data)
+            # Sets the length, leaving any trailing hole unwritten
+            os.ftruncate(fd_out, st.st_size)
+        finally:
+            os.close(fd_out)
+    finally:
+        os.close(fd_in)
+    shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    return dst
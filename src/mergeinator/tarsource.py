@@ -0,0 +1,264 @@
+"""Merging straight from a tar archive, without extracting it first.
+
+The usual way to merge a backup tarball is to extract it next to the
+destination and merge that, which writes the whole archive to disk just
+so most of it can be deleted again.  merge_tar() instead streams the
+archive once, in order, and compares each member with the same path
+under the destination:
+
+  * missing from the destination: offer to extract it;
+  * a different size: it differs;
+  * otherwise it's decided like files are (see compare.policy_verdict()):
+    with --trust-metadata, the same mtime means identical, apart from a
+    sample that's read anyway.  Reading compares the member's data with
+    the destination file as it streams past, stopping at the first
+    difference.  If that member is to be extracted after all, the part
+    that matched is copied from the destination file and the rest comes
+    from the stream, so nothing is read twice.
+
+Only regular files and symlinks are merged.  Directories are created as
+their contents need them (so empty directories in the archive aren't
+recreated), and hard links and special files are skipped.  The archive
+itself is left alone.
+"""
+
+import os
+import tarfile
+import tempfile
+from datetime import datetime as dt
+from types import SimpleNamespace
+
+from .compare import _Reader, block_size, policy_verdict
+from .logs import NORMAL, WHT, YEL
+from .mergeinator import filestr, not_dead_gen
+from .nicer import nice_delta, nice_size
+
+COPY_SIZE = 1024 * 1024
+TAR_SUFFIXES = (".tar", ".tgz", ".tbz2", ".txz", ".tar.gz", ".tar.bz2", ".tar.xz")
+
+
+def is_tar_source(path):
+    """Return True if path is named like a (possibly compressed) tar archive.
+
+    Goes by name, not content: tarfile.is_tarfile() also accepts anything
+    that starts with a zeroed block, like many disk images.
+    """
+    return os.path.isfile(path) and path.lower().endswith(TAR_SUFFIXES)
+
+
+def _member_path(dest, name):
+    """Return where member name goes under dest, or None if it would escape dest."""
+    # Leading slashes are stripped, like tar does by default
+    parts = [p for p in name.split("/") if p not in ["", "."]]
+    if not parts or ".." in parts:
+        return None
+    return os.path.join(dest, *parts)
+
+
+def _inside(dest, path):
+    """Return True if path's directory really is under dest (no symlink escapes)."""
+    real_dest = os.path.realpath(dest)
+    parent = os.path.realpath(os.path.dirname(path))
+    return parent == real_dest or parent.startswith(real_dest + os.sep)
+
+
+def _unique_name(path):
+    """Return path with a suffix that makes it a name not already in use."""
+    base, ext = os.path.splitext(path)
+    n = 1
+    while os.path.lexists(f"{base}.from-archive-{n}{ext}"):
+        n += 1
+    return f"{base}.from-archive-{n}{ext}"
+
+
+def _first_difference(session, stream, dest_path):
+    """Compare stream with dest_path, same sized, a block at a time.
+
+    Return None if they match, or (offset, block) for the first stream
+    block that doesn't.  Everything before offset is in both.
+    """
+    size = block_size(session, os.stat(dest_path))
+    reader = _Reader(dest_path)
+    try:
+        offset = 0
+        while True:
+            block = stream.read(size)
+            if not block:
+                return None
+            theirs = reader.pread(offset, len(block))
+            session.count("bytes_read", len(block) + len(theirs))
+            if block != theirs:
+                return offset, block
+            offset += len(block)
+    finally:
+        reader.close()
+
+
+def _write_member(session, member, stream, target, prefix_path=None, prefix=0, block=b""):
+    """Write the rest of member's data to target, atomically.
+
+    The first prefix bytes come from prefix_path (they've already streamed
+    past and matched it), then block, then whatever is left of stream.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".merge-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if prefix:
+                with open(prefix_path, "rb") as f:
+                    left = prefix
+                    while left:
+                        data = f.read(min(COPY_SIZE, left))
+                        if not data:
+                            raise OSError(f"{prefix_path} got shorter while extracting over it")
+                        out.write(data)
+                        left -= len(data)
+            out.write(block)
+            while True:
+                data = stream.read(COPY_SIZE)
+                if not data:
+                    break
+                out.write(data)
+        # No setuid, setgid or sticky bits from an untrusted archive, like tarfile's data_filter
+        os.chmod(tmp, member.mode & 0o777)
+        os.utime(tmp, (member.mtime, member.mtime))
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    session.count("bytes_extracted", member.size)
+
+
+def _extract(session, label, member, tar, path):
+    """Offer to extract a member the destination doesn't have."""
+    session.ui(f"{WHT}{label}{NORMAL} ?--> {session.dest_abbrev}", end="")
+    if session.answer("  Safe.  Extract? [Y/n]") not in ["", "y"]:
+        return
+    session.count("extracted")
+    if session.dry_run:
+        session.count("bytes_extracted", member.size)
+        return
+    if member.issym():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.symlink(member.linkname, path)
+    else:
+        _write_member(session, member, tar.extractfile(member), path)
+    session.log(f"Extracted {label} to {path}")
+
+
+def _verdict(session, member, stream, path, st):
+    """Decide whether regular file member matches path (see compare.policy_verdict()).
+
+    Return None if it does, or the (offset, block) where it stopped
+    matching (offset 0 and no block if it wasn't read).
+    """
+    member_st = SimpleNamespace(st_size=member.size, st_mtime_ns=round(member.mtime * 10**9))
+    return policy_verdict(session, path, st, member_st,
+                          lambda: _first_difference(session, stream, path),
+                          root=os.path.dirname(path), unread=(0, b""))
+
+
+def _differs(session, label, member, stream, path, st, difference):
+    """Report a member that differs from path and offer to replace or keep both."""
+    session.ui(f"{WHT}{label}{NORMAL} ?--> {YEL}{path}{NORMAL}  Differs.")
+    newer = member.mtime > st.st_mtime
+    if int(member.mtime) != int(st.st_mtime):
+        readable_date = dt.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        amount = nice_delta(abs(member.mtime - st.st_mtime))
+        session.ui(f"The archive's copy is {amount} {'newer' if newer else 'older'} than "
+                   f"{YEL}{path}{NORMAL} ({readable_date}).")
+    if member.size == st.st_size:
+        session.ui(f"Both are {nice_size(member.size)}.")
+    else:
+        session.ui(f"The archive's copy is {nice_size(member.size)}, "
+                   f"{YEL}{path}{NORMAL} is {nice_size(st.st_size)}.")
+    # With --yes (or just Enter), the newer copy wins
+    if newer:
+        action = session.answer("[R]eplace with the archive's copy, [k]eep both, "
+                                "or [s]kip [R/k/s]?")
+        action = "r" if action in ["", "y"] else action
+    else:
+        action = session.answer("[r]eplace with the archive's copy, [k]eep both, "
+                                "or [S]kip [r/k/S]?")
+        action = "s" if action in ["", "y"] else action
+    if action == "r":
+        target = path
+        session.count("replaced")
+    elif action == "k":
+        target = _unique_name(path)
+        session.count("kept_both")
+    else:
+        session.count("skipped_members")
+        return
+    if session.dry_run:
+        session.count("bytes_extracted", member.size)
+        return
+    offset, block = difference
+    _write_member(session, member, stream, target, path, offset, block)
+    session.log(f"Extracted {label} to {target}")
+
+
+def _merge_member(session, label, member, tar, path, tick):
+    """Merge one regular file or symlink member into path."""
+    if not os.path.lexists(path):
+        _extract(session, label, member, tar, path)
+        return
+    st = os.lstat(path)
+    if member.issym():
+        if os.path.islink(path) and os.readlink(path) == member.linkname:
+            session.count("identical_members")
+        else:
+            session.ui(f"{label} is a symlink to {member.linkname}, {path} isn't.  "
+                       "Skipping.")
+            session.count("skipped_members")
+        return
+    if not os.path.isfile(path) or os.path.islink(path):
+        session.ui(f"{label} is a file, {path} isn't.  Skipping.")
+        session.count("skipped_members")
+        return
+    stream = tar.extractfile(member)
+    difference = _verdict(session, member, stream, path, st)
+    if difference is None:
+        session.count("identical_members")
+        next(tick)
+    else:
+        _differs(session, label, member, stream, path, st, difference)
+
+
+def merge_tar(session, archive):
+    """Merge the members of tar file archive into session.dest_dir, in one pass."""
+    tick = not_dead_gen(session)
+    dest = session.dest_dir
+    # "r|*" streams: no seeking back, whatever the compression
+    with tarfile.open(archive, "r|*") as tar:
+        for member in tar:
+            if session.over_budget():
+                break
+            if member.isdir():
+                continue
+            label = f"{archive}:{member.name}"
+            path = _member_path(dest, member.name)
+            if path is None or not _inside(dest, path):
+                session.ui(f"{YEL}Skipping {label}, which would land outside "
+                           f"{filestr(dest)}.{NORMAL}")
+                session.count("skipped_members")
+                continue
+            parts = os.path.relpath(path, dest).split(os.sep)
+            if any(session.rules.classify(part) for part in parts):
+                session.log(f"Skipped {label} (prune/junk rule)")
+                continue
+            if not (member.isfile() or member.issym()):
+                session.ui(f"Skipping {label}, which isn't a file or a symlink.")
+                session.count("skipped_members")
+                continue
+
+            try:
+                _merge_member(session, label, member, tar, path, tick)
+            except OSError as e:
+                session.ui(f"{YEL}Couldn't merge {label}: {e}{NORMAL}")
+                session.count("skipped_members")
+
+    done = "Would extract" if session.dry_run else "Extracted"
+    written = sum(session.stats[k] for k in ["extracted", "replaced", "kept_both"])
+    session.ui(f"{done} {written} members ({nice_size(session.stats['bytes_extracted'])}).  "
+               f"{session.stats['identical_members']} were already in {dest}.")
@@ -0,0 +1,188 @@
+"""Instant deletes: rename doomed files into a trash directory, purge later.
+
+Deleting a big duplicate tree can take minutes, and the prompt waits for
+it.  In trash mode, remove() instead renames the path into a trash
+directory on the same filesystem, which is instant no matter how big the
+tree is.  Each run gets its own subdirectory of the trash with a
+manifest of what came from where, so `merge --undo` can put the most
+recent run's deletions back.
+
+When a run first trashes something on a filesystem, the trash from
+earlier runs there is purged in the background at idle I/O priority.
+`merge --purge` purges all of it right away.  A run holds a lock on its
+directory until its session is closed (or the process exits), and
+neither purging nor --undo touches a run whose lock is still held, so
+concurrent merges can share a trash.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime as dt
+from subprocess import DEVNULL, Popen, run
+
+TRASH_NAME = ".merge-trash"
+MANIFEST = "manifest.jsonl"
+LOCK = "lock"
+
+
+def _mount_point(path):
+    """Return the highest ancestor of path on the same filesystem."""
+    path = os.path.abspath(path)
+    dev = os.lstat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.lstat(parent).st_dev != dev:
+            return path
+        path = parent
+
+
+def _within(path, dirs):
+    return any(path == d or path.startswith(d.rstrip(os.sep) + os.sep) for d in dirs)
+
+
+def trash_root(path, avoid=()):
+    """Return the trash directory for path's filesystem.
+
+    That's .merge-trash at the filesystem's mount point, or if we can't
+    write there, in the highest writable directory above path on that
+    filesystem.  It's never inside the directories in avoid (e.g. the
+    merge's source and destination), where it would get merged itself.
+    """
+    path = os.path.abspath(path)
+    avoid = [os.path.abspath(d) for d in avoid]
+    # For --undo, path may be what got deleted
+    while not os.path.lexists(path):
+        path = os.path.dirname(path)
+    top = _mount_point(path)
+    # Start from the parent: the trash can't go inside what's being trashed
+    candidate = os.path.dirname(path) if path != top else top
+    best = None
+    while True:
+        if os.access(candidate, os.W_OK) and not _within(candidate, avoid):
+            best = candidate
+        if candidate == top:
+            break
+        candidate = os.path.dirname(candidate)
+    return os.path.join(best or top, TRASH_NAME)
+
+
+def purge_command(paths):
+    """Return a command that deletes paths at idle I/O and CPU priority."""
+    cmd = []
+    if shutil.which("ionice"):
+        cmd += ["ionice", "-c", "3"]
+    elif shutil.which("taskpolicy"):
+        # MacOS: background QoS throttles disk I/O
+        cmd += ["taskpolicy", "-b"]
+    if shutil.which("nice"):
+        cmd += ["nice", "-n", "19"]
+    return cmd + ["rm", "-rf"] + list(paths)
+
+
+def _is_live(run_dir):
+    """Return True if the session that owns run_dir still holds its lock."""
+    try:
+        fd = os.open(os.path.join(run_dir, LOCK), os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def _runs(root):
+    """Return the finished per-run trash directories under root, oldest first."""
+    try:
+        # Hidden names are runs still being set up
+        names = [d for d in os.listdir(root) if not d.startswith(".")]
+    except FileNotFoundError:
+        return []
+    return [run_dir for run_dir in sorted(os.path.join(root, d) for d in names)
+            if not _is_live(run_dir)]
+
+
+def _session_trash(session, path):
+    """Return this session's trash directory for path's filesystem, creating it."""
+
+    def create():
+        root = session.trash_dir or trash_root(path, session.sources + [session.dest_dir])
+        stale = _runs(root)
+        os.makedirs(root, exist_ok=True)
+        # Lock the run before it's visible, so it's never mistaken for a finished one
+        setup = tempfile.mkdtemp(dir=root, prefix=".")
+        lock = open(os.path.join(setup, LOCK), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        session.on_close(lock.close)
+        run_dir = os.path.join(root, session.run_id)
+        os.rename(setup, run_dir)
+        if stale:
+            session.log(f"Purging old trash in the background: {stale}")
+            # Detached, so it keeps going after we exit
+            Popen(purge_command(stale), stdout=DEVNULL, stderr=DEVNULL,
+                  start_new_session=True)
+        return run_dir
+
+    key = "trash" if session.trash_dir else ("trash", os.lstat(path).st_dev)
+    return session.cached(key, create)
+
+
+def trash(session, path):
+    """Rename path into the trash.  Return False if it can't be (e.g. cross-device)."""
+    try:
+        run_dir = _session_trash(session, path)
+        with session.lock:
+            session.count("trashed")
+            target = os.path.join(run_dir, str(session.stats["trashed"]))
+            os.rename(path, target)
+            with open(os.path.join(run_dir, MANIFEST), "a") as f:
+                record = {"original": os.path.abspath(path), "trashed": target,
+                          "time": dt.now().isoformat()}
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        session.log(f"Can't trash {path} ({e}), deleting it instead.")
+        return False
+    session.log(f"Trashed {path} to {target}")
+    return True
+
+
+def undo(session, path):
+    """Put back everything the most recent finished run trashed on path's filesystem."""
+    runs = _runs(session.trash_dir or trash_root(path))
+    if not runs:
+        session.ui("Nothing to undo.")
+        return
+    run_dir = runs[-1]
+    try:
+        with open(os.path.join(run_dir, MANIFEST)) as f:
+            records = [json.loads(line) for line in f]
+    except FileNotFoundError:
+        records = []
+    kept = 0
+    for record in reversed(records):
+        original, trashed = record["original"], record["trashed"]
+        if os.path.lexists(original):
+            session.ui(f"{original} exists again, leaving its old copy in {trashed}.")
+            kept += 1
+            continue
+        os.makedirs(os.path.dirname(original), exist_ok=True)
+        os.rename(trashed, original)
+        session.ui(f"Restored {original}")
+    if kept == 0:
+        shutil.rmtree(run_dir)
+
+
+def purge(session, path):
+    """Delete the trash of all finished runs on path's filesystem, at idle priority."""
+    runs = _runs(session.trash_dir or trash_root(path))
+    if not runs:
+        session.ui("No trash to purge.")
+        return
+    session.ui(f"Purging {len(runs)} runs' trash...")
+    run(purge_command(runs))
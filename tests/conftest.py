@@ -0,0 +1,34 @@
+import pytest
+
+from mergeinator import MergeSession
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    """Return a function making quiet MergeSessions that log to tmp_path/merge.log.
+
+    dest defaults to tmp_path; keyword arguments go to MergeSession.
+    """
+
+    def make(dest=None, **kwargs):
+        kwargs.setdefault("echo", lambda *a, **kw: None)
+        kwargs.setdefault("log_path", str(tmp_path / "merge.log"))
+        return MergeSession(str(tmp_path if dest is None else dest), **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def make_tree():
+    """Return a function that creates files under root from {relative path: content}."""
+
+    def make(root, files):
+        for name, content in files.items():
+            path = root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, bytes):
+                path.write_bytes(content)
+            else:
+                path.write_text(content)
+
+    return make
@@ -0,0 +1,81 @@
+import os
+
+from mergeinator import compare
+from mergeinator.compare import KB, MB, block_size, compare_files, compare_paths
+
+
+def test_compare_files_identical(tmp_path, make_session):
+    data = os.urandom(3 * MB + 17)
+    (tmp_path / "a").write_bytes(data)
+    (tmp_path / "b").write_bytes(data)
+    session = make_session()
+    assert compare_files(session, str(tmp_path / "a"), str(tmp_path / "b"))
+    assert session.stats["bytes_read"] == 2 * len(data)
+
+
+def test_compare_files_stops_at_first_difference(tmp_path, make_session, monkeypatch):
+    monkeypatch.setattr("mergeinator.compare.MAX_BLOCK", MB)
+    data = bytearray(8 * MB)
+    (tmp_path / "a").write_bytes(data)
+    data[10] = 1
+    (tmp_path / "b").write_bytes(data)
+    session = make_session()
+    assert not compare_files(session, str(tmp_path / "a"), str(tmp_path / "b"))
+    assert session.stats["bytes_read"] < 2 * len(data)
+
+
+def test_block_size_follows_device(tmp_path, make_session, monkeypatch):
+    monkeypatch.setattr(compare.sys, "platform", "linux")
+    st = os.stat(tmp_path)
+    monkeypatch.setattr(compare, "_sysfs_io_size", lambda dev: 128 * KB)
+    assert block_size(make_session(), st) == 128 * KB
+    # A device that doesn't say gets the default, not a fixed floor
+    monkeypatch.setattr(compare, "_sysfs_io_size", lambda dev: 0)
+    assert block_size(make_session(), st) == compare.DEFAULT_BLOCK
+
+
+def test_compare_paths_trees(tmp_path, make_session):
+    for side in ["a", "b"]:
+        os.makedirs(tmp_path / side / "sub")
+        (tmp_path / side / "sub" / "f").write_text("same")
+        os.symlink("f", tmp_path / side / "sub" / "link")
+    session = make_session()
+    assert compare_paths(session, str(tmp_path / "a"), str(tmp_path / "b"))
+
+    os.remove(tmp_path / "b" / "sub" / "link")
+    os.symlink("elsewhere", tmp_path / "b" / "sub" / "link")
+    assert not compare_paths(session, str(tmp_path / "a"), str(tmp_path / "b"))
+
+
+def make_twins(tmp_path, names, differ=()):
+    """Make a/ and b/ with files of the same size and mtime; names in differ differ."""
+    for side in ["a", "b"]:
+        os.makedirs(tmp_path / side, exist_ok=True)
+        for name in names:
+            path = tmp_path / side / name
+            path.write_text(side if name in differ else "x")
+            os.utime(path, ns=(10**18, 10**18))
+
+
+def test_trust_metadata_skips_reads(tmp_path, make_session):
+    make_twins(tmp_path, ["f1", "f2", "f3"], differ=["f2"])
+    session = make_session()
+    session.trust_metadata = True
+    session.sample_rate = 0
+    assert compare_paths(session, str(tmp_path / "a"), str(tmp_path / "b"))
+    assert session.stats["bytes_read"] == 0
+    assert session.stats["metadata_verdicts"] == 3
+
+
+def test_sampled_mismatch_escalates(tmp_path, make_session):
+    make_twins(tmp_path, ["f1", "f2"], differ=["f1", "f2"])
+    session = make_session()
+    session.trust_metadata = True
+    session.sample_rate = 1
+    assert not compare_paths(session, str(tmp_path / "a"), str(tmp_path / "b"))
+    assert session.is_escalated(str(tmp_path / "a" / "f2"))
+
+    # Once escalated, even unsampled pairs are read in full
+    session.sample_rate = 0
+    assert not compare_paths(session, str(tmp_path / "a" / "f2"), str(tmp_path / "b" / "f2"))
+    assert session.stats["full_verdicts"] == 1
@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from mergeinator.gitrepo import compare_repos
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git to build repos")
+
+
+def git(repo, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@t", GIT_COMMITTER_NAME="t",
+               GIT_COMMITTER_EMAIL="t@t")
+    subprocess.run(["git", "-C", str(repo)] + list(args), check=True, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def commit(repo, name):
+    (repo / name).write_text(name)
+    git(repo, "add", name)
+    git(repo, "commit", "-q", "-m", name)
+
+
+def copy_git_dir(repo, dest):
+    shutil.copytree(repo / ".git", dest / ".git")
+    return dest / ".git"
+
+
+def test_compare_repos(tmp_path, make_session):
+    session = make_session()
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    commit(repo, "one")
+    src = copy_git_dir(repo, tmp_path / "src")
+
+    # Same history, different layout
+    git(repo, "gc", "-q")
+    assert compare_repos(session, str(src), str(repo / ".git")) == "identical"
+
+    # Destination has moved on
+    commit(repo, "two")
+    git(repo, "gc", "-q")
+    assert compare_repos(session, str(src), str(repo / ".git")) == "contains"
+
+    # Source has a commit the destination doesn't
+    commit(tmp_path / "src", "three")
+    assert compare_repos(session, str(src), str(repo / ".git")) is None
+
+
+def test_truncated_destination_objects(tmp_path, make_session):
+    session = make_session()
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    commit(repo, "one")
+    dest = copy_git_dir(repo, tmp_path / "dest")
+    # Same refs, but the copy of the object store was cut short
+    shutil.rmtree(dest / "objects")
+    (dest / "objects").mkdir()
+    assert compare_repos(session, str(repo / ".git"), str(dest)) is None
+
+
+def test_missing_packed_history(tmp_path, make_session):
+    session = make_session()
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    commit(repo, "one")
+    git(repo, "gc", "-q")
+    commit(repo, "two")
+    # An interrupted copy: the new tip is loose, but the packed history is gone
+    dest = copy_git_dir(repo, tmp_path / "dest")
+    shutil.rmtree(dest / "objects" / "pack")
+    assert compare_repos(session, str(repo / ".git"), str(dest)) is None
+    # With everything there, packed and deltified or not, it's identical
+    git(repo, "gc", "-q", "--aggressive")
+    assert compare_repos(session, str(repo / ".git"), str(copy_git_dir(repo, tmp_path / "ok"))) \
+        == "identical"
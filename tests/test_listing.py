@@ -0,0 +1,27 @@
+from mergeinator.listing import merge_join, sorted_names
+
+
+def make_dir(path, names):
+    path.mkdir()
+    for name in names:
+        (path / name).write_text(name)
+
+
+def test_sorted_names_spills_runs(tmp_path):
+    names = [f"f{i:03}" for i in range(50)] + ["new\nline"]
+    make_dir(tmp_path / "d", names)
+    assert list(sorted_names(str(tmp_path / "d"), run_size=7)) == sorted(names)
+
+
+def test_merge_join(tmp_path):
+    make_dir(tmp_path / "src", ["a", "both1", "c", "both2"])
+    make_dir(tmp_path / "dest", ["both1", "b", "both2", "z"])
+    joined = list(merge_join(str(tmp_path / "src"), str(tmp_path / "dest"), run_size=2))
+    assert joined == [
+        ("a", True, False),
+        ("b", False, True),
+        ("both1", True, True),
+        ("both2", True, True),
+        ("c", True, False),
+        ("z", False, True),
+    ]
@@ -0,0 +1,43 @@
+import os
+
+from mergeinator.overlay import Overlay
+
+
+def snapshot(root):
+    return sorted((os.path.relpath(os.path.join(d, f), root), open(os.path.join(d, f)).read())
+                  for d, _, files in os.walk(root) for f in files)
+
+
+def test_overlay_move_and_remove(tmp_path, make_tree):
+    make_tree(tmp_path, {"src/a/x": "x", "src/b": "b", "dest/c": "c"})
+    overlay = Overlay()
+    overlay.move(str(tmp_path / "src/a"), str(tmp_path / "dest/a"))
+    overlay.remove(str(tmp_path / "src/b"))
+
+    assert not overlay.lexists(str(tmp_path / "src/a/x"))
+    assert overlay.resolve(str(tmp_path / "dest/a/x")) == str(tmp_path / "src/a/x")
+    assert overlay.resolve(str(tmp_path / "src/b")) is None
+    assert overlay.changes(str(tmp_path / "dest")) == (set(), ["a"])
+    assert overlay.changes(str(tmp_path / "src")) == ({"a", "b"}, [])
+
+
+def test_dry_run_plays_out_every_level(tmp_path, make_session, make_tree):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    make_tree(src, {"deep/er/same": "same", "deep/er/new": "new", "top": "top"})
+    make_tree(dest, {"deep/er/same": "same", "deep/other": "other"})
+    before = snapshot(tmp_path)
+
+    def ask(question):
+        raise AssertionError("dry run asked a question")
+
+    # Log outside the tree, so it's left exactly as it was
+    session = make_session(dest, dry_run=True, ask=ask,
+                           log_path=str(tmp_path.parent / "merge.log"))
+    session.merge(str(src))
+
+    assert snapshot(tmp_path) == before
+    # new and top moved, same deleted, then deep/er and deep deleted once empty
+    assert session.stats["moved"] == 2
+    assert session.stats["removed"] == 3
+    assert not session.lexists(str(src / "deep"))
+    assert session.lexists(str(dest / "deep/er/new"))
@@ -0,0 +1,49 @@
+from mergeinator.rules import Rules
+
+
+def test_classify():
+    rules = Rules(prune=["node_modules", "*.cache"], junk=[".DS_Store", "._*"])
+    assert rules.classify("node_modules") == "prune"
+    assert rules.classify("pip.cache") == "prune"
+    assert rules.classify("._foo") == "junk"
+    assert rules.classify(".DS_Store") == "junk"
+    assert rules.classify("src") is None
+    assert Rules().classify(".DS_Store") is None
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / "rules"
+    path.write_text("# comment\n\nbuild\nprune: .git\njunk: Thumbs.db\n")
+    rules = Rules.from_file(str(path), junk=[".DS_Store"])
+    assert rules.classify("build") == "prune"
+    assert rules.classify(".git") == "prune"
+    assert rules.classify("Thumbs.db") == "junk"
+    assert rules.classify(".DS_Store") == "junk"
+
+
+def test_walk_prunes_and_deletes_junk(tmp_path, make_session):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    (src / "node_modules").mkdir(parents=True)
+    (src / "node_modules" / "x").write_text("x")
+    (src / ".DS_Store").write_text("junk")
+    dest.mkdir()
+    session = make_session(dest, yes=True,
+                           rules=Rules(prune=["node_modules"], junk=[".DS_Store"]))
+    session.merge(str(src))
+    assert sorted(p.name for p in src.iterdir()) == ["node_modules"]
+    assert list(dest.iterdir()) == []
+
+
+def test_pruned_entries_keep_their_parent(tmp_path, make_session):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    (src / "proj" / "node_modules").mkdir(parents=True)
+    (src / "proj" / "node_modules" / "only_here").write_text("x")
+    (src / "proj" / "f").write_text("f")
+    (src / "proj" / ".DS_Store").write_text("junk")
+    (dest / "proj").mkdir(parents=True)
+    (dest / "proj" / "f").write_text("f")
+    session = make_session(dest, yes=True,
+                           rules=Rules(prune=["node_modules"], junk=[".DS_Store"]))
+    session.merge(str(src))
+    assert (src / "proj" / "node_modules" / "only_here").exists()
+    assert not (src / "proj" / "f").exists()
@@ -0,0 +1,83 @@
+import inspect
+import os
+import re
+import sys
+
+import pytest
+
+from mergeinator.schedule import parse_budget, tree_size
+
+
+def test_parse_budget():
+    assert parse_budget("90m") == (90 * 60, None)
+    assert parse_budget("2h") == (7200, None)
+    assert parse_budget("50GB") == (None, 50 * 1024**3)
+    assert parse_budget("1.5 M") == (None, int(1.5 * 1024**2))
+    with pytest.raises(ValueError):
+        parse_budget("lots")
+
+
+def test_largest_first_order(tmp_path, make_session):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    for side in [src, dest]:
+        (side / "dir").mkdir(parents=True)
+        (side / "dir" / "big").write_bytes(b"b" * 200_000)
+        (side / "medium").write_bytes(b"m" * 50_000)
+        (side / "small").write_bytes(b"s" * 10)
+        # Make dir differ, so it has to be opened up
+        (side / "dir" / "differs").write_text(side.name)
+
+    order = []
+
+    def echo(*args, **kwargs):
+        line = re.sub(r"\x1b\[[0-9;]*m", "", str(args[0])) if args else ""
+        if "?-->" in line:
+            order.append(line.split(" ?-->")[0].rstrip("/").split("/")[-1])
+
+    session = make_session(dest, ask=lambda q: "n" if "older file" in q else "y", echo=echo,
+                           largest_first=True)
+    session.merge(str(src))
+    # Once dir is opened up, dir/big comes before the smaller top-level files
+    assert order == ["dir", "big", "medium", "small", "differs"]
+    assert sorted(p.name for p in src.iterdir()) == ["dir"]
+    assert [p.name for p in (src / "dir").iterdir()] == ["differs"]
+    assert session.stats["bytes_freed"] >= 250_000
+
+
+def test_byte_budget_stops_early(tmp_path, make_session):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    for side in [src, dest]:
+        side.mkdir()
+        (side / "big").write_bytes(b"b" * 200_000)
+        (side / "small").write_bytes(b"s" * 10)
+    session = make_session(dest, yes=True, largest_first=True, budget_bytes=100_000)
+    session.merge(str(src))
+    assert [p.name for p in src.iterdir()] == ["small"]
+
+
+def test_emptied_ancestors_are_deleted(tmp_path, make_session):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    for side in [src, dest]:
+        (side / "a" / "b").mkdir(parents=True)
+        (side / "a" / "b" / "f").write_text("f")
+    (src / "a" / "b" / "g").write_text("src")
+    (dest / "a" / "b" / "g").write_text("dest")
+    session = make_session(dest, yes=True, largest_first=True)
+    session.merge(str(src))
+    assert list(src.iterdir()) == []
+
+
+def test_tree_size_deeper_than_recursion_limit(tmp_path, make_session):
+    deep = os.path.join(tmp_path, *["d"] * 200)
+    os.makedirs(deep)
+    with open(os.path.join(deep, "f"), "wb") as f:
+        f.write(b"x" * 100_000)
+    session = make_session()
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(inspect.stack()) + 100)
+    try:
+        size = tree_size(session, str(tmp_path / "d"))
+    finally:
+        sys.setrecursionlimit(limit)
+    assert size == os.lstat(os.path.join(deep, "f")).st_blocks * 512
+    assert session.sizes[deep] == size
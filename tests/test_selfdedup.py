@@ -0,0 +1,49 @@
+import os
+
+from mergeinator.selfdedup import Index, dedup
+
+
+def test_reports_highest_level_only(tmp_path, make_session, make_tree):
+    root = tmp_path / "tree"
+    project = {"src/main.c": b"int main;", "README": b"hello" * 100, "empty": b""}
+    make_tree(root, {f"a/project/{k}": v for k, v in project.items()})
+    make_tree(root, {f"b/copy/{k}": v for k, v in project.items()})
+    make_tree(root, {"c/main.c": b"int main;", "c/other": b"hello" * 99 + b"world",
+                     "d/empty": b""})
+
+    index = Index(make_session(root), str(tmp_path / "index.db"))
+    index.build(str(root))
+    groups = [(kind, [os.path.relpath(path, root) for path, _, covered in members if not covered])
+              for kind, _, members in index.duplicates()]
+    index.close()
+
+    # The project copies, then c/main.c, which matches files inside them
+    assert groups[0] == ("dir", ["a/project", "b/copy"])
+    assert ("file", ["c/main.c"]) in groups
+    # Same size as README but different content; empty files don't count
+    assert not any("c/other" in paths or "d/empty" in paths for _, paths in groups)
+
+
+def test_dedup_deletes_extras(tmp_path, make_session, make_tree):
+    root = tmp_path / "tree"
+    make_tree(root, {"one/photo.jpg": b"x" * 100_000, "two/photo.jpg": b"x" * 100_000,
+                     "three/photo.jpg": b"x" * 99_999 + b"y"})
+    os.link(root / "one/photo.jpg", root / "one/hardlink.jpg")
+
+    session = make_session(root, dry_run=True)
+    dedup(session, str(root))
+    assert (root / "two").exists()
+    assert session.stats["removed"] == 2
+
+    session = make_session(root, yes=True)
+    dedup(session, str(root))
+    assert sorted(os.listdir(root)) == ["one", "three"]
+    assert sorted(os.listdir(root / "one")) == ["hardlink.jpg", "photo.jpg"]
+
+
+def test_trash_is_never_the_kept_copy(tmp_path, make_session, make_tree):
+    root = tmp_path / "tree"
+    make_tree(root, {".merge-trash/run/1/photo.jpg": b"x" * 1000, "Photos/photo.jpg": b"x" * 1000})
+    dedup(make_session(root, yes=True), str(root))
+    assert (root / "Photos/photo.jpg").exists()
+    assert (root / ".merge-trash/run/1/photo.jpg").exists()
@@ -0,0 +1,36 @@
+import os
+import threading
+
+
+def test_answer_uses_ask_callback(make_session):
+    session = make_session(ask=lambda q: "Y")
+    assert session.answer("Delete? [Y/n]") == "y"
+
+
+def test_dry_run_answers_default_without_asking(make_session):
+    def ask(question):
+        raise AssertionError("dry run asked a question")
+
+    session = make_session(dry_run=True, ask=ask)
+    assert session.answer("Delete? [Y/n]") == ""
+    session = make_session(dry_run=True, yes=True, ask=ask)
+    assert session.answer("Delete? [Y/n]") == "y"
+
+
+def test_concurrent_sessions(tmp_path, make_session, make_tree):
+    sessions = []
+    for i in range(4):
+        src, dest = tmp_path / f"src{i}", tmp_path / f"dest{i}"
+        make_tree(src, {"same": "same", f"only{i}": "new"})
+        make_tree(dest, {"same": "same"})
+        sessions.append((make_session(dest, yes=True), str(src)))
+
+    threads = [threading.Thread(target=s.merge, args=(src, )) for s, src in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(4):
+        assert os.listdir(tmp_path / f"src{i}") == []
+        assert sorted(os.listdir(tmp_path / f"dest{i}")) == [f"only{i}", "same"]
@@ -0,0 +1,41 @@
+import os
+
+from mergeinator.compare import MB, compare_files
+from mergeinator.sparse import sparse_copy2, union_extents
+
+
+def make_sparse(path, size, writes):
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for offset, data in writes:
+            f.seek(offset)
+            f.write(data)
+
+
+def test_union_extents():
+    assert union_extents([(0, 4), (10, 12)], [(2, 6), (12, 14), (20, 21)]) == \
+        [(0, 6), (10, 14), (20, 21)]
+
+
+def test_compare_sparse_reads_only_data(tmp_path, make_session):
+    session = make_session()
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    make_sparse(a, 256 * MB, [(100 * MB, b"data")])
+    # A written run of zeros matches a hole
+    make_sparse(b, 256 * MB, [(100 * MB, b"data"), (200 * MB, bytes(MB))])
+    assert compare_files(session, a, b)
+    if os.stat(a).st_blocks * 512 < MB:
+        # The filesystem made a real hole, so it shouldn't have been read
+        assert session.stats["bytes_read"] < 64 * MB
+
+    make_sparse(b, 256 * MB, [(100 * MB, b"DATA")])
+    assert not compare_files(session, a, b)
+
+
+def test_sparse_copy_keeps_holes(tmp_path):
+    src, dst = str(tmp_path / "src"), str(tmp_path / "dst")
+    make_sparse(src, 64 * MB, [(MB, b"hello"), (32 * MB, b"world")])
+    sparse_copy2(src, dst)
+    with open(src, "rb") as f1, open(dst, "rb") as f2:
+        assert f1.read() == f2.read()
+    assert os.stat(dst).st_blocks <= os.stat(src).st_blocks
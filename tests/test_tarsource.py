@@ -0,0 +1,109 @@
+import io
+import os
+import tarfile
+
+from mergeinator import compare
+from mergeinator.tarsource import is_tar_source, merge_tar
+
+
+def make_archive(path, members, mtime=1_000_000_000):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            if isinstance(content, tuple):
+                info.type, info.linkname = tarfile.SYMTYPE, content[1]
+                tar.addfile(info)
+            else:
+                info.size, info.mtime = len(content), mtime
+                tar.addfile(info, io.BytesIO(content))
+
+
+def test_extracts_only_missing_and_newer(tmp_path, make_session):
+    archive = tmp_path / "backup.tar.gz"
+    make_archive(archive, {"same": b"same", "new/file": b"new", "changed": b"newer text",
+                           "link": ("symlink", "same")})
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "same").write_bytes(b"same")
+    (dest / "changed").write_bytes(b"old")
+    os.utime(dest / "changed", (0, 0))
+    assert is_tar_source(str(archive))
+    # A disk image starting with zeros looks like a tar file to tarfile
+    image = tmp_path / "disk.img"
+    image.write_bytes(bytes(10_000))
+    assert not is_tar_source(str(image))
+
+    session = make_session(dest, yes=True)
+    merge_tar(session, str(archive))
+
+    assert (dest / "new/file").read_bytes() == b"new"
+    assert (dest / "changed").read_bytes() == b"newer text"
+    assert os.path.getmtime(dest / "changed") == 1_000_000_000
+    assert os.readlink(dest / "link") == "same"
+    assert session.stats["identical_members"] == 1
+    assert session.stats["extracted"] == 2
+    assert session.stats["replaced"] == 1
+
+
+def test_difference_found_mid_stream(tmp_path, monkeypatch, make_session):
+    monkeypatch.setattr(compare, "MIN_BLOCK", 4096)
+    monkeypatch.setattr(compare, "MAX_BLOCK", 4096)
+    theirs = b"a" * 8192 + b"b" * 4096
+    ours = b"a" * 8192 + b"c" * 4096
+    archive = tmp_path / "backup.tar.gz"
+    make_archive(archive, {"big": theirs})
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "big").write_bytes(ours)
+    os.utime(dest / "big", (0, 0))
+
+    session = make_session(dest, ask=lambda q: "k")
+    merge_tar(session, str(archive))
+
+    assert (dest / "big").read_bytes() == ours
+    assert (dest / "big.from-archive-1").read_bytes() == theirs
+
+
+def test_dry_run_and_escapes_write_nothing(tmp_path, make_session):
+    archive = tmp_path / "backup.tar.gz"
+    make_archive(archive, {"new": b"new", "../outside": b"evil", "evil": ("symlink", ".."),
+                           "evil/also": b"evil"})
+    dest = tmp_path / "dest"
+    dest.mkdir()
+
+    session = make_session(dest, dry_run=True)
+    merge_tar(session, str(archive))
+    assert os.listdir(dest) == []
+    assert session.stats["extracted"] > 0
+
+    session = make_session(dest, yes=True)
+    merge_tar(session, str(archive))
+    assert sorted(os.listdir(dest)) == ["evil", "new"]
+    assert not (tmp_path / "outside").exists() and not (tmp_path / "also").exists()
+
+
+def test_special_mode_bits_dropped(tmp_path, make_session):
+    archive = tmp_path / "backup.tar"
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo("tool")
+        info.size, info.mode = 4, 0o6755
+        tar.addfile(info, io.BytesIO(b"tool"))
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    merge_tar(make_session(dest, yes=True), str(archive))
+    assert os.stat(dest / "tool").st_mode & 0o7777 == 0o755
+
+
+def test_trusted_mtimes_match_like_files(tmp_path, make_session):
+    # Same second, different fractions: not the same mtime, so read in full
+    archive = tmp_path / "backup.tar.gz"
+    make_archive(archive, {"f": b"theirs"}, mtime=1_000_000_000.25)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "f").write_bytes(b"ours!!")
+    os.utime(dest / "f", (1_000_000_000.75, 1_000_000_000.75))
+
+    session = make_session(dest, ask=lambda q: "s", trust_metadata=True, sample_rate=0)
+    merge_tar(session, str(archive))
+    assert session.stats["full_verdicts"] == 1
+    assert session.stats["skipped_members"] == 1
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from mergeinator.mergeinator import remove
+from mergeinator.trash import purge, trash_root, undo
+
+
+@pytest.fixture
+def trash_session(tmp_path, make_session):
+    return lambda: make_session(trash=True, trash_dir=str(tmp_path / "trash"))
+
+
+def test_trash_and_undo(tmp_path, trash_session):
+    (tmp_path / "tree" / "sub").mkdir(parents=True)
+    (tmp_path / "tree" / "sub" / "f").write_text("f")
+    (tmp_path / "file").write_text("file")
+
+    with trash_session() as session:
+        remove(session, str(tmp_path / "tree"))
+        remove(session, str(tmp_path / "file"))
+    assert not os.path.exists(tmp_path / "tree")
+    assert not os.path.exists(tmp_path / "file")
+
+    undo(trash_session(), str(tmp_path))
+    assert (tmp_path / "tree" / "sub" / "f").read_text() == "f"
+    assert (tmp_path / "file").read_text() == "file"
+    assert os.listdir(tmp_path / "trash") == []
+
+
+def test_purge(tmp_path, trash_session):
+    (tmp_path / "file").write_text("file")
+    with trash_session() as session:
+        remove(session, str(tmp_path / "file"))
+    assert len(os.listdir(tmp_path / "trash")) == 1
+    purge(trash_session(), str(tmp_path))
+    assert os.listdir(tmp_path / "trash") == []
+
+
+def test_concurrent_sessions_keep_their_trash(tmp_path, trash_session):
+    (tmp_path / "a").write_text("a")
+    (tmp_path / "b").write_text("b")
+    first, second = trash_session(), trash_session()
+    remove(first, str(tmp_path / "a"))
+    # Starting a run purges finished runs, but not one that's still going
+    remove(second, str(tmp_path / "b"))
+    assert len(os.listdir(tmp_path / "trash")) == 2
+
+    second.close()
+    undo(trash_session(), str(tmp_path))
+    assert (tmp_path / "b").read_text() == "b"
+    assert not (tmp_path / "a").exists()
+    first.close()
+    undo(trash_session(), str(tmp_path))
+    assert (tmp_path / "a").read_text() == "a"
+
+
+def test_trash_root_of_deleted_path(tmp_path):
+    root = trash_root(str(tmp_path / "gone" / "away"))
+    assert os.path.basename(root) == ".merge-trash"
+    assert str(tmp_path).startswith(os.path.dirname(root))
+
+
+def test_trash_root_avoids_merge_dirs(tmp_path, monkeypatch):
+    source = tmp_path / "data" / "a"
+    (source / "x").mkdir(parents=True)
+    # Only the source is writable
+    monkeypatch.setattr("mergeinator.trash.os.access", lambda p, mode: p.startswith(str(source)))
+    assert trash_root(str(source / "x")) == str(source / ".merge-trash")
+    assert not trash_root(str(source / "x"), [str(source)]).startswith(str(source))
+
+
+def test_merge_leaves_trash_alone(tmp_path, make_session, make_tree):
+    make_tree(tmp_path, {"src/.merge-trash/run/1": "trashed", "src/sub/.merge-trash/run/1": "t",
+                         "src/sub/f": "f", "dest/sub/f": "f"})
+    make_session(tmp_path / "dest", yes=True).merge(str(tmp_path / "src"))
+    assert (tmp_path / "src/.merge-trash/run/1").exists()
+    # sub matches apart from its trash, so only f goes
+    assert sorted(os.listdir(tmp_path / "src/sub")) == [".merge-trash"]
+    assert not (tmp_path / "dest/.merge-trash").exists()